@@ -0,0 +1,314 @@
+""" Headless benchmarks for noise, terrain generation and tile lookup
+
+Runs without a display, using SDL's dummy video driver, and prints the
+results as JSON:
+
+    python benchmark.py > before.json
+    python benchmark.py --only noise --output after.json
+
+Every benchmark takes a number of timed samples.  Each result has the
+throughput in items per second (noise values, tiles or frames) and the
+50th and 99th percentile latency of one sample, in milliseconds.
+"""
+import argparse
+import json
+import os
+import pickle
+import platform
+import sys
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # keep stdout valid json
+
+import numpy as np
+import pygame
+import pyscroll
+
+from lib import chunkformat, perlin
+from lib.chunks import CHUNK_SIZE
+from lib.entities import Entities, tinted_images
+from lib.generator import WATER
+from lib.infinitemap import InfiniteMap
+from lib.perlin import SimplexNoise, TileableNoise
+
+VIEW_SIZES = ((20, 15), (32, 32), (64, 64))
+
+
+def summarize(unit, items, times):
+    """ Make the result of one benchmark
+
+    :param unit: what an item is
+    :param items: items done in each sample
+    :param times: seconds taken by each sample
+    :return: dict
+    """
+    times = np.array(times)
+    return {
+        'unit': unit,
+        'samples': len(times),
+        'items_per_sample': items,
+        'per_sec': round(items * len(times) / times.sum(), 1),
+        'p50_ms': round(float(np.percentile(times, 50)) * 1000, 4),
+        'p99_ms': round(float(np.percentile(times, 99)) * 1000, 4),
+    }
+
+
+def timed(func, samples):
+    """ Call func samples times, and return the time each call took """
+    times = list()
+    for i in range(samples):
+        begin = perf_counter()
+        func(i)
+        times.append(perf_counter() - begin)
+    return times
+
+
+def bench_noise(samples):
+    results = dict()
+    simplex = SimplexNoise()
+    tileable = TileableNoise()
+    n = 1000
+    # a grid of 4D samples, as for animating the visible water tiles
+    xs = np.arange(128, dtype=np.float64)[np.newaxis, :] / 16
+    ys = np.arange(128, dtype=np.float64)[:, np.newaxis] / 16
+
+    def noise2(i):
+        noise = simplex.noise2
+        for x in range(n):
+            noise(x * .37, i * 1.3)
+
+    def noise3(i):
+        noise = simplex.noise3
+        for x in range(n):
+            noise(x * .37, i * 1.3, .5)
+
+    def tileable3(i):
+        noise = tileable.noise3
+        for x in range(n):
+            noise(x * .37, i * 1.3, .5, 8)
+
+    def noise2_grid(i):
+        simplex.noise2_grid(0, i * 32, 32, 32, 32)
+
+    def noise4_array(i):
+        simplex.noise4_array(xs, ys, i * .1, .5)
+
+    def tileable3_grid(i):
+        tileable.noise3_grid(128, 128, 8, i * .5)
+
+    results['noise2'] = summarize('values', n, timed(noise2, samples))
+    results['noise3'] = summarize('values', n, timed(noise3, samples))
+    results['tileable_noise3'] = summarize('values', n, timed(tileable3, samples))
+    results['noise2_grid_32x32'] = summarize('values', 32 * 32, timed(noise2_grid, samples))
+    results['noise4_array_128x128'] = summarize('values', 128 * 128, timed(noise4_array, samples))
+    results['tileable_noise3_grid_128x128'] = summarize('values', 128 * 128, timed(tileable3_grid, samples))
+    return results
+
+
+def bench_prepare(samples, workers):
+    results = dict()
+    map_data = InfiniteMap(workers=workers)
+    map_data.preview_step = 0  # time the real chunks
+    try:
+        for index, (w, h) in enumerate(VIEW_SIZES):
+            def prepare(i):
+                # a new place every time, so the terrain has to be generated
+                x = (index * samples + i + 1) * 64 * CHUNK_SIZE
+                map_data.prepare_tiles(pygame.Rect(x, x, w, h))
+
+            name = 'prepare_tiles_{}x{}'.format(w, h)
+            results[name] = summarize('tiles', w * h, timed(prepare, samples))
+    finally:
+        map_data.close()
+    return results
+
+
+def bench_lookup(samples):
+    results = dict()
+    map_data = InfiniteMap()
+    w, h = 64, 64
+    x0, y0 = 500, 500
+    map_data.prepare_tiles(pygame.Rect(x0, y0, w, h))
+    get_tile_image = map_data.get_tile_image
+
+    def row_major(i):
+        for y in range(y0, y0 + h):
+            for x in range(x0, x0 + w):
+                get_tile_image(x, y, 0)
+
+    def column_major(i):
+        for x in range(x0, x0 + w):
+            for y in range(y0, y0 + h):
+                get_tile_image(x, y, 0)
+
+    results['get_tile_image_row_major'] = summarize('tiles', w * h, timed(row_major, samples))
+    results['get_tile_image_column_major'] = summarize('tiles', w * h, timed(column_major, samples))
+    return results
+
+
+def bench_pan(samples, workers, screen_size=(1024, 768), speed=(9, 5)):
+    """ Scroll a pyscroll renderer diagonally, one frame per sample """
+    map_data = InfiniteMap(workers=workers)
+    try:
+        map_layer = pyscroll.BufferedRenderer(map_data, screen_size)
+        surface = pygame.display.get_surface()
+        tw, th = map_data.tile_size
+        start = 512 * tw, 512 * th
+
+        def frame(i):
+            map_layer.center((start[0] + i * speed[0], start[1] + i * speed[1]))
+            map_layer.draw(surface, surface.get_rect())
+
+        result = summarize('frames', 1, timed(frame, samples))
+        result['view_tiles'] = (screen_size[0] // tw) * (screen_size[1] // th)
+        return {'pan': result}
+    finally:
+        map_data.close()
+
+
+def bench_serialize(samples, chunk_count=64):
+    """ Encode and decode generated chunks in every chunkformat compression
+
+    pickle of the arrays is included to compare with.
+    """
+    results = dict()
+    map_data = InfiniteMap()
+    world = map_data.world
+    chunks = [map_data.chunks.get(i % 8, i // 8) for i in range(chunk_count)]
+    raw_bytes = chunk_count * (CHUNK_SIZE * CHUNK_SIZE * 3)
+
+    def add(name, encode, decode):
+        encoded = [encode(chunk) for chunk in chunks]
+
+        def encode_all(i):
+            for chunk in chunks:
+                encode(chunk)
+
+        def decode_all(i):
+            for data in encoded:
+                decode(data)
+
+        size = sum(len(data) for data in encoded)
+        for action, func in (('encode', encode_all), ('decode', decode_all)):
+            result = summarize('chunks', chunk_count, timed(func, samples))
+            result['mb_per_sec'] = round(raw_bytes / 2 ** 20 * result['per_sec'] / chunk_count, 1)
+            result['bytes_per_chunk'] = round(size / chunk_count, 1)
+            results['{}_{}'.format(action, name)] = result
+
+    for name, compression in sorted(chunkformat.COMPRESSIONS.items()):
+        add(name, lambda chunk: chunkformat.encode_chunk(chunk, world, compression), chunkformat.decode_chunk)
+    add('pickle', lambda chunk: pickle.dumps((chunk.cx, chunk.cy, chunk.biome, chunk.tiles), -1), pickle.loads)
+    return results
+
+
+def bench_queries(samples, count=1000):
+    """ Spatial queries around the origin, once the chunks are generated """
+    results = dict()
+    map_data = InfiniteMap()
+    rng = np.random.default_rng(0)
+    points = rng.integers(-256, 256, (samples, count, 2))
+    map_data.get_region(-320, -320, 640, 640)
+
+    def biome_at(i):
+        map_data.biome_at(points[i])
+
+    def nearest(i):
+        for x, y in points[i, :100]:
+            map_data.nearest(WATER, (x, y), 64)
+
+    def tiles_of(i):
+        x, y = points[i, 0]
+        map_data.tiles_of(WATER, (x, y, 64, 64))
+
+    def sweep(i):
+        for x, y in points[i, :100] * 32:
+            map_data.sweep_rect((x, y, 16, 8), 5.0, -5.0)
+
+    results['biome_at'] = summarize('points', count, timed(biome_at, samples))
+    results['nearest_water_64'] = summarize('queries', 100, timed(nearest, samples))
+    results['tiles_of_64x64'] = summarize('tiles', 64 * 64, timed(tiles_of, samples))
+    results['sweep_rect'] = summarize('queries', 100, timed(sweep, samples))
+    return results
+
+
+def bench_entities(samples, counts=(1000, 10000)):
+    """ Batch updates of wandering entities, and picking the ones on screen """
+    results = dict()
+    map_data = InfiniteMap()
+    map_data.get_region(-96, -96, 192, 192)
+    images = tinted_images(pygame.Surface((48, 48), pygame.SRCALPHA))
+    view = pygame.Rect(-512, -384, 1024, 768)
+    group = pygame.sprite.Group()
+    for count in counts:
+        entities = Entities(map_data, images, seed=0)
+        entities.spawn_around((0, 0), 64 * 32, count)
+        # past the first idle time, so most of them wander
+        for i in range(50):
+            entities.update(.1)
+
+        def update(i):
+            entities.update(1 / 60.)
+
+        def show(i):
+            entities.show(group, view)
+
+        results['entities_update_{}'.format(count)] = summarize('entities', len(entities), timed(update, samples))
+        results['entities_show_{}'.format(count)] = summarize('entities', len(entities), timed(show, samples))
+    return results
+
+
+BENCHMARKS = ('noise', 'prepare', 'lookup', 'pan', 'serialize', 'queries', 'entities')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', choices=BENCHMARKS, action='append',
+                        help='benchmark to run; may be repeated (default: all)')
+    parser.add_argument('--samples', type=int, default=50, help='samples per benchmark')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes for generation')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    pygame.display.set_mode((1024, 768))
+
+    selected = args.only or BENCHMARKS
+    results = dict()
+    if 'noise' in selected:
+        results.update(bench_noise(args.samples))
+    if 'prepare' in selected:
+        results.update(bench_prepare(args.samples, args.workers))
+    if 'lookup' in selected:
+        results.update(bench_lookup(args.samples))
+    if 'pan' in selected:
+        results.update(bench_pan(args.samples * 10, args.workers))
+    if 'serialize' in selected:
+        results.update(bench_serialize(args.samples))
+    if 'queries' in selected:
+        results.update(bench_queries(args.samples))
+    if 'entities' in selected:
+        results.update(bench_entities(args.samples))
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'workers': args.workers,
+        'noise_backend': perlin.backend,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    else:
+        print(text)
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
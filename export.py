@@ -0,0 +1,85 @@
+""" Export a region of the world as .npy arrays and/or a PNG image
+
+Runs without a display.  The region is generated by worker processes and
+written in bands, so large regions do not need much memory:
+
+    python export.py 0 0 16384 16384 --npy world --png world.png --scale 1
+
+--npy world writes world-biome.npy and world-tiles.npy, indexed [y, x].
+The PNG is made from the tiles of terrain_atlas.png, shrunk to --scale
+pixels per tile.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+import pygame
+
+from lib.export import BAND_HEIGHT, NpyWriter, PngWriter, atlas_tiles, default_terrain, export_region
+from lib.resources import load_image
+
+TILE_SIZE = 32
+
+
+def load_atlas(scale):
+    """ Get the tiles of terrain_atlas.png, drawn over black, as an array """
+    surface = load_image('terrain_atlas.png')
+    rgb = pygame.surfarray.array3d(surface).swapaxes(0, 1).astype(np.float64)
+    alpha = pygame.surfarray.array_alpha(surface).swapaxes(0, 1)[:, :, np.newaxis] / 255.
+    return atlas_tiles(rgb * alpha, TILE_SIZE, scale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('x', type=int, help='left tile')
+    parser.add_argument('y', type=int, help='top tile')
+    parser.add_argument('width', type=int, help='width in tiles')
+    parser.add_argument('height', type=int, help='height in tiles')
+    parser.add_argument('--npy', metavar='PREFIX', help='write PREFIX-biome.npy and PREFIX-tiles.npy')
+    parser.add_argument('--png', metavar='FILE', help='write an image of the tiles')
+    parser.add_argument('--scale', type=int, default=TILE_SIZE,
+                        help='pixels per tile in the image; must divide {}'.format(TILE_SIZE))
+    parser.add_argument('--noise-size', type=float, default=32, help='scale of the streams noise')
+    parser.add_argument('--seed', type=int, help='noise seed (default: the default noise)')
+    parser.add_argument('--band', type=int, default=BAND_HEIGHT, help='rows of tiles in each band')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes; 0 to generate here (default: one per cpu)')
+    args = parser.parse_args(argv)
+
+    if not (args.npy or args.png):
+        parser.error('nothing to write; use --npy and/or --png')
+    if args.width <= 0 or args.height <= 0:
+        parser.error('the region is empty')
+
+    writers = list()
+    if args.npy:
+        writers.append(NpyWriter(args.npy, args.width, args.height))
+    if args.png:
+        writers.append(PngWriter(args.png, args.width, args.height, load_atlas(args.scale)))
+
+    terrain = default_terrain(args.noise_size, args.seed)
+    begin = perf_counter()
+
+    def progress(done, total):
+        print('\rband {}/{}'.format(done, total), end='', file=sys.stderr, flush=True)
+
+    try:
+        export_region(args.x, args.y, args.width, args.height, terrain, writers, args.band, args.workers,
+                      progress)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    tiles = args.width * args.height
+    elapsed = perf_counter() - begin
+    print('\n{} tiles in {:.1f}s ({:.0f} tiles/s)'.format(tiles, elapsed, tiles / elapsed), file=sys.stderr)
+    print('world', terrain.world.to_string(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+""" Edge tile selection for whole blocks of tiles
+
+Each tile is scored by which of the 9 tiles around it (itself included)
+belong to a neighbouring biome; the score picks the edge tile to use.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+POWERS9 = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+# POWERS9 as a 3x3 kernel indexed [dy + 1, dx + 1]: columns left to right,
+# and top to bottom inside each column
+KERNEL9 = np.array(POWERS9, dtype=np.uint16).reshape((3, 3)).T
+
+SCORES = 512
+
+
+def score(biome, secondary):
+    """ Score every tile of a block
+
+    The block must have a 1 tile border around the tiles to be scored.
+
+    :param biome: 2D array of biomes
+    :param secondary: biome that is counted
+    :return: 2D uint16 array, 2 smaller than biome in each dimension
+    """
+    mask = (biome == secondary).astype(np.uint16)
+    windows = sliding_window_view(mask, (3, 3))
+    return np.tensordot(windows, KERNEL9, axes=2).astype(np.uint16)
+
+
+def lookup_table(rules, palette):
+    """ Get an array of the tile id to use for every score
+
+    :param rules: RuleTable
+    :param palette: sequence of tile ids, indexed by tile type
+    :return: uint16 array of SCORES tile ids
+    """
+    return rules.resolve(palette)[rules.types]
+
+
+class RuleTable(object):
+    """ Edge tile rules compiled by compile_rules
+
+    types is a uint8 array with the tile type for every score.  gaps lists
+    the combinations of corners that no rule covers; they use tile type 0.
+    """
+
+    def __init__(self, types, fallbacks, gaps):
+        self.types = types
+        self.fallbacks = fallbacks
+        self.gaps = gaps
+
+    def tile_type(self, score):
+        return int(self.types[score])
+
+    def resolve(self, palette):
+        """ Get the tile id for every tile type of a palette
+
+        Tile types without a tile use their fallback.
+
+        :param palette: sequence of tile ids, indexed by tile type
+        :return: uint16 array of tile ids, indexed by tile type
+        """
+        ids = list()
+        for tile_type in range(len(palette)):
+            seen = set()
+            while palette[tile_type] is None:
+                seen.add(tile_type)
+                try:
+                    tile_type = self.fallbacks[tile_type]
+                except KeyError:
+                    raise ValueError('palette has no tile for type {}, and no fallback'.format(tile_type))
+                if tile_type in seen:
+                    raise ValueError('fallbacks for tile type {} loop'.format(tile_type))
+            ids.append(palette[tile_type])
+        return np.array(ids, dtype=np.uint16)
+
+
+def compile_rules(rules):
+    """ Build a table of tile types for every score from a rules module
+
+    See lib/rules.py for the format.  Raises ValueError if the rules name
+    unknown tiles or corners, or if two tile types have the same corners.
+
+    :param rules: module or object with neighbours, corners, roles and fallbacks
+    :return: RuleTable
+    """
+    if len(rules.neighbours) != len(POWERS9):
+        raise ValueError('rules must name {} neighbours'.format(len(POWERS9)))
+    bits = dict(zip(rules.neighbours, POWERS9))
+
+    corner_masks = list()
+    for corner, touching in rules.corners.items():
+        unknown = set(touching) - set(bits)
+        if unknown:
+            raise ValueError('corner {} has unknown tiles: {}'.format(corner, sorted(unknown)))
+        corner_masks.append((corner, sum(bits[name] for name in touching)))
+
+    types_by_corners = dict()
+    conflicts = list()
+    for tile_type, corners in sorted(rules.roles.items()):
+        key = frozenset(corners)
+        unknown = key - set(rules.corners)
+        if unknown:
+            raise ValueError('tile type {} has unknown corners: {}'.format(tile_type, sorted(unknown)))
+        if key in types_by_corners:
+            conflicts.append((types_by_corners[key], tile_type))
+        types_by_corners[key] = tile_type
+    if conflicts:
+        raise ValueError('tile types with the same corners: {}'.format(conflicts))
+
+    types = np.zeros(SCORES, dtype=np.uint8)
+    gaps = set()
+    for i in range(SCORES):
+        key = frozenset(corner for corner, mask in corner_masks if i & mask)
+        try:
+            types[i] = types_by_corners[key]
+        except KeyError:
+            gaps.add(tuple(sorted(key)))
+
+    return RuleTable(types, dict(rules.fallbacks), sorted(gaps))
@@ -0,0 +1,150 @@
+""" Binary chunk format
+
+Used wherever chunks leave a process: the disk cache, worker processes
+and the chunk server.
+
+Layout:
+    header: magic, format version, compression, chunk size, cx, cy,
+            length of the world, length of the data
+    world: World.to_string(), utf-8, padded to 4 bytes; may be empty
+    data:
+        RAW: biome, CHUNK_SIZE * CHUNK_SIZE uint8, then tiles, uint16
+        RLE: biome runs, then tile runs; each is a count, the run
+             lengths as uint16 and the values
+        ZLIB: RAW data, compressed
+
+Every number is little endian.  RAW chunks are decoded without copying:
+the arrays are views of the data.  Chunks are mostly long runs of the same
+tile, so RLE and ZLIB are a fraction of the size.
+"""
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from lib.chunks import CHUNK_SIZE, Chunk
+from lib.world import World
+
+MAGIC = b'WGCK'
+FORMAT_VERSION = 1
+
+RAW = 0
+RLE = 1
+ZLIB = 2
+COMPRESSIONS = {'raw': RAW, 'rle': RLE, 'zlib': ZLIB}
+
+HEADER = struct.Struct('<4sBBHiiH2xI')
+COUNT = struct.Struct('<I')
+BIOME_SIZE = CHUNK_SIZE * CHUNK_SIZE
+TILES_SIZE = CHUNK_SIZE * CHUNK_SIZE * 2
+
+# bytes of a RAW chunk without a world
+RAW_SIZE = HEADER.size + BIOME_SIZE + TILES_SIZE
+
+# zlib level; higher levels are much slower and barely smaller
+ZLIB_LEVEL = 1
+
+Header = namedtuple('Header', 'version compression size cx cy world_length data_length')
+
+
+def _runs(array, dtype):
+    flat = array.ravel()
+    starts = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1])))
+    lengths = np.diff(np.append(starts, flat.size))
+    return COUNT.pack(len(starts)) + lengths.astype('<u2').tobytes() + flat[starts].astype(dtype).tobytes()
+
+
+def _expand(data, offset, dtype):
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    lengths = np.frombuffer(data, '<u2', count, offset)
+    offset += count * 2
+    values = np.frombuffer(data, dtype, count, offset)
+    offset += count * values.itemsize
+    return np.repeat(values, lengths), offset
+
+
+def encode_chunk(chunk, world=None, compression=RAW):
+    """ Get the bytes of a chunk
+
+    :param chunk: Chunk
+    :param world: World the chunk is from, or None to leave it out
+    :param compression: RAW, RLE or ZLIB
+    :return: bytes
+    """
+    if compression == RLE:
+        data = _runs(chunk.biome, np.uint8) + _runs(chunk.tiles, '<u2')
+    else:
+        data = chunk.biome.astype(np.uint8).tobytes() + chunk.tiles.astype('<u2').tobytes()
+        if compression == ZLIB:
+            data = zlib.compress(data, ZLIB_LEVEL)
+        elif compression != RAW:
+            raise ValueError('unknown compression: {}'.format(compression))
+
+    text = b'' if world is None else world.to_string().encode()
+    padding = b'\0' * (-len(text) % 4)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, compression, CHUNK_SIZE, chunk.cx, chunk.cy,
+                         len(text), len(data))
+    return b''.join((header, text, padding, data))
+
+
+def read_header(data, offset=0):
+    """ Read and check the header of an encoded chunk
+
+    Raises ValueError if the data is not a chunk, or is from another
+    version or chunk size.
+
+    :return: Header
+    """
+    if len(data) - offset < HEADER.size:
+        raise ValueError('not a chunk: too short')
+    magic, version, compression, size, cx, cy, world_length, data_length = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError('not a chunk')
+    if version != FORMAT_VERSION:
+        raise ValueError('chunk format version {} is not {}'.format(version, FORMAT_VERSION))
+    if size != CHUNK_SIZE:
+        raise ValueError('chunk size {} is not {}'.format(size, CHUNK_SIZE))
+    return Header(version, compression, size, cx, cy, world_length, data_length)
+
+
+def decode_chunk(data, offset=0):
+    """ Make a chunk from bytes made by encode_chunk
+
+    RAW chunks are views of data, and are read only if data is.  Keep
+    data unchanged while they are in use.
+
+    :param data: bytes, memoryview, mmap or other buffer
+    :param offset: where the chunk starts in data
+    :return: (Chunk, World or None)
+    """
+    header = read_header(data, offset)
+    data = memoryview(data)
+    start = offset + HEADER.size
+    world = None
+    if header.world_length:
+        world = World.from_string(bytes(data[start:start + header.world_length]).decode())
+    start += header.world_length + -header.world_length % 4
+    if len(data) < start + header.data_length:
+        raise ValueError('chunk {}, {} is truncated'.format(header.cx, header.cy))
+
+    compression = header.compression
+    if compression == ZLIB:
+        data = zlib.decompress(data[start:start + header.data_length])
+        start = 0
+        compression = RAW
+
+    if compression == RAW:
+        biome = np.frombuffer(data, np.uint8, BIOME_SIZE, start)
+        tiles = np.frombuffer(data, '<u2', BIOME_SIZE, start + BIOME_SIZE)
+    elif compression == RLE:
+        biome, start = _expand(data, start, np.uint8)
+        tiles, start = _expand(data, start, '<u2')
+        if biome.size != BIOME_SIZE or tiles.size != BIOME_SIZE:
+            raise ValueError('runs of chunk {}, {} do not fill it'.format(header.cx, header.cy))
+    else:
+        raise ValueError('unknown compression: {}'.format(compression))
+
+    shape = CHUNK_SIZE, CHUNK_SIZE
+    return Chunk(header.cx, header.cy, biome.reshape(shape), tiles.reshape(shape)), world
@@ -0,0 +1,247 @@
+""" Chunked storage for infinite maps
+
+The world is split into square chunks of CHUNK_SIZE x CHUNK_SIZE tiles.
+Chunks are allocated when they are first requested and are kept in a least
+recently used cache, so memory depends on what is near the camera, not on
+the size of the world.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+CHUNK_SIZE = 32
+CHUNK_BUDGET = 32 * 1024 * 1024  # bytes
+
+
+def chunk_coords(x, y):
+    """ Get the chunk and the position inside of it for a tile
+
+    :param x: tile x
+    :param y: tile y
+    :return: (chunk_x, chunk_y, local_x, local_y)
+    """
+    cx, lx = divmod(x, CHUNK_SIZE)
+    cy, ly = divmod(y, CHUNK_SIZE)
+    return cx, cy, lx, ly
+
+
+def chunk_rect(x, y, w, h):
+    """ Get the chunks that cover a rectangle of tiles
+
+    :return: (left, top, right, bottom) chunk coordinates, inclusive
+    """
+    return x // CHUNK_SIZE, y // CHUNK_SIZE, (x + w - 1) // CHUNK_SIZE, (y + h - 1) // CHUNK_SIZE
+
+
+def chunk_ring(cx, cy):
+    """ Get the tiles just outside of a chunk
+
+    :return: four (x, y, width, height) rects of tiles, one tile thick
+    """
+    x, y = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+    return ((x - 1, y - 1, CHUNK_SIZE + 2, 1), (x - 1, y + CHUNK_SIZE, CHUNK_SIZE + 2, 1),
+            (x - 1, y, 1, CHUNK_SIZE), (x + CHUNK_SIZE, y, 1, CHUNK_SIZE))
+
+
+def chunk_range(x, y, w, h):
+    """ Get the chunks that cover a rectangle of tiles
+
+    :return: (chunk_x, chunk_y) iterator, row by row
+    """
+    return rect_difference(chunk_rect(x, y, w, h), None)
+
+
+def rect_difference(new, old):
+    """ Get the chunks in one chunk rect that are not in another
+
+    Only the chunks in the difference are visited, so moving a rect by a
+    little costs as much as its perimeter, not its area.
+
+    :param new: (left, top, right, bottom), inclusive
+    :param old: (left, top, right, bottom), inclusive, or None
+    :return: (chunk_x, chunk_y) iterator, row by row
+    """
+    left, top, right, bottom = new
+    if old is None:
+        old = left, top, left - 1, top - 1  # empty
+    old_left, old_top, old_right, old_bottom = old
+    for cy in range(top, bottom + 1):
+        if old_top <= cy <= old_bottom and old_left <= old_right:
+            for cx in range(left, min(right, old_left - 1) + 1):
+                yield cx, cy
+            for cx in range(max(left, old_right + 1), right + 1):
+                yield cx, cy
+        else:
+            for cx in range(left, right + 1):
+                yield cx, cy
+
+
+class Chunk(object):
+    """ Fixed size block of map data
+
+    Arrays are indexed [local_y, local_x].  Existing arrays can be passed
+    in, and will be used without copying.
+
+    preview is true for a coarse stand-in, shown until the real chunk is
+    generated.
+
+    index is the spatial.ChunkIndex of the chunk, once it is queried,
+    labels its regions.ChunkLabels, once it is labeled, and solid its
+    collision bitmask from lib/collision.py.
+    """
+    __slots__ = ('cx', 'cy', 'biome', 'tiles', 'preview', 'index', 'labels', 'solid')
+
+    def __init__(self, cx, cy, biome=None, tiles=None):
+        self.cx = cx
+        self.cy = cy
+        if biome is None:
+            biome = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+        if tiles is None:
+            tiles = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint16)
+        self.biome = biome
+        self.tiles = tiles
+        self.preview = False
+        self.index = None
+        self.labels = None
+        self.solid = None
+
+    @property
+    def origin(self):
+        """ Tile coordinates of the top left corner """
+        return self.cx * CHUNK_SIZE, self.cy * CHUNK_SIZE
+
+    @property
+    def nbytes(self):
+        """ Memory of the arrays, and of the index, labels and solid when they are set """
+        nbytes = self.biome.nbytes + self.tiles.nbytes
+        if self.index is not None:
+            nbytes += self.index.nbytes
+        if self.labels is not None:
+            nbytes += self.labels.labels.nbytes
+        if self.solid is not None:
+            nbytes += self.solid.nbytes
+        return nbytes
+
+
+class ChunkStore(object):
+    """ Chunks keyed by (chunk_x, chunk_y), with LRU eviction
+
+    Missing chunks are created by calling factory(chunk_x, chunk_y).  When
+    the chunks use more than budget bytes, the least recently used ones are
+    discarded; they will be created again if they are needed later.
+
+    Chunks inside the pinned rect are never discarded, so the chunks on
+    screen stay even if they have not been used for a while.
+
+    hits and misses count the calls to get that found a chunk, and the
+    ones that had to create one.
+    """
+
+    def __init__(self, factory, budget=CHUNK_BUDGET):
+        self.factory = factory
+        self.budget = budget
+        self.nbytes = 0
+        self.pinned = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._chunks = OrderedDict()
+        # bytes counted for each chunk, which may grow after it is stored
+        self._sizes = dict()
+
+    def __contains__(self, key):
+        return key in self._chunks
+
+    def __getitem__(self, key):
+        """ Get a chunk, without creating it or counting it as used """
+        return self._chunks[key]
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __iter__(self):
+        """ Iterate over the keys, least recently used first """
+        return iter(list(self._chunks))
+
+    def get(self, cx, cy):
+        """ Get a chunk, creating it if needed
+
+        :param cx: chunk x
+        :param cy: chunk y
+        :return: Chunk
+        """
+        key = cx, cy
+        chunks = self._chunks
+        try:
+            chunk = chunks[key]
+        except KeyError:
+            self.misses += 1
+            chunk = self.factory(cx, cy)
+            self.put(chunk)
+        else:
+            self.hits += 1
+            chunks.move_to_end(key)
+        return chunk
+
+    def pin(self, rect):
+        """ Keep the chunks in a rect from being discarded
+
+        Replaces the rect that was pinned before.
+
+        :param rect: (left, top, right, bottom) chunk coordinates, inclusive, or None
+        """
+        self.pinned = rect
+
+    def is_pinned(self, key):
+        if self.pinned is None:
+            return False
+        left, top, right, bottom = self.pinned
+        cx, cy = key
+        return left <= cx <= right and top <= cy <= bottom
+
+    def put(self, chunk):
+        """ Add a chunk, replacing one with the same coordinates """
+        key = chunk.cx, chunk.cy
+        old = self._chunks.pop(key, None)
+        if old is not None:
+            self.nbytes -= self._sizes[key]
+        self._chunks[key] = chunk
+        self._sizes[key] = chunk.nbytes
+        self.nbytes += self._sizes[key]
+        self.evict()
+
+    def update(self, key):
+        """ Count a stored chunk again, after arrays were attached to it """
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            return
+        nbytes = chunk.nbytes
+        self.nbytes += nbytes - self._sizes[key]
+        self._sizes[key] = nbytes
+        self.evict()
+
+    def discard(self, key):
+        """ Remove a chunk, if it is stored """
+        chunk = self._chunks.pop(key, None)
+        if chunk is not None:
+            self.nbytes -= self._sizes.pop(key)
+
+    def evict(self):
+        """ Discard least recently used chunks until inside the budget """
+        chunks = self._chunks
+        is_pinned = self.is_pinned
+        while self.nbytes > self.budget:
+            for key in chunks:
+                if not is_pinned(key):
+                    break
+            else:
+                # only pinned chunks are left
+                break
+            chunks.pop(key)
+            self.nbytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def clear(self):
+        self._chunks.clear()
+        self._sizes.clear()
+        self.nbytes = 0
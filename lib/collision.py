@@ -0,0 +1,57 @@
+""" Terrain collision
+
+Each chunk gets a bitmask of the tiles that can not be walked on: one
+integer per row, with bit x set if tile x of the row is solid.  That is
+CHUNK_SIZE words per chunk, and testing a rect against a chunk is an OR of
+the rows it covers, so the cost of a query depends on the tiles it
+touches, not on the size of the map or the number of sprites.
+
+InfiniteMap.collide_rect and sweep_rect are built on these.
+"""
+import numpy as np
+
+from lib.chunks import CHUNK_SIZE
+from lib.generator import WALL, WATER
+
+# biomes that sprites can not walk on
+SOLID_BIOMES = (WATER, WALL)
+
+# value of the bit of each column
+_BITS = np.uint64(1) << np.arange(CHUNK_SIZE, dtype=np.uint64)
+
+
+def solid_rows(biome):
+    """ Get the collision bitmask of a biome array
+
+    :param biome: CHUNK_SIZE x CHUNK_SIZE biome array
+    :return: uint64 array of CHUNK_SIZE rows; bit x is set for solid tiles
+    """
+    return (np.isin(biome, SOLID_BIOMES) * _BITS).sum(axis=1, dtype=np.uint64)
+
+
+def collision_mask(chunk):
+    """ Get the collision bitmask of a chunk, making it if needed """
+    if chunk.solid is None:
+        chunk.solid = solid_rows(chunk.biome)
+    return chunk.solid
+
+
+def tile_span(start, end, size):
+    """ Get the tiles that pixels from start up to end cover
+
+    :param start: first pixel
+    :param end: pixel after the last one
+    :param size: tile size, in pixels
+    :return: (first, last) tile, inclusive; last < first if none
+    """
+    return int(start // size), int(-(-end // size)) - 1
+
+
+def lowest_bit(bits):
+    """ Get the position of the lowest set bit of a nonzero integer """
+    return (bits & -bits).bit_length() - 1
+
+
+def highest_bit(bits):
+    """ Get the position of the highest set bit of a nonzero integer """
+    return bits.bit_length() - 1
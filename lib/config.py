@@ -1 +1,2 @@
-RESOURCES_DIR = 'resources'
\ No newline at end of file
+RESOURCES_DIR = 'resources'
+CACHE_DIR = 'cache'
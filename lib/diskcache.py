@@ -0,0 +1,307 @@
+""" Persistent chunk cache
+
+Generated chunks are saved in one file per world, and read back through
+mmap, so chunks loaded from the cache are views of the file, not copies.
+
+The file name is made from the rules version and a hash of everything else
+that changes the terrain (the world descriptor and chunk size).
+When the rules change, files made with older rules are deleted.
+
+The files in a folder are kept under CACHE_BUDGET bytes in total: a file
+stops growing at the budget, and the least recently opened files are
+deleted when the folder is over it.
+
+Several processes can share a folder.  Opening, adding chunks, and
+deleting files happen while holding the lock file of the folder, and each
+process keeps a shared lock on the cache file it has open, so files that
+are in use are never deleted.  Locks need fcntl, so there are none on
+Windows, where open files can not be deleted anyway.
+
+File layout:
+    header: magic, format version, chunk size, capacity, count
+    records: capacity records of RECORD_SIZE bytes
+        flags, padding
+        chunk: RAW chunk without a world, see lib/chunkformat.py
+"""
+import hashlib
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from lib import chunkformat
+from lib.chunks import CHUNK_SIZE
+
+MAGIC = b'WGCHUNK\0'
+FORMAT_VERSION = 2
+
+HEADER = struct.Struct('<8sIIII')
+RECORD_HEADER = struct.Struct('<I4x')
+RECORD_SIZE = RECORD_HEADER.size + chunkformat.RAW_SIZE
+
+VALID = 1
+INITIAL_CAPACITY = 256
+
+# bytes of cache files in a folder
+CACHE_BUDGET = 256 * 2 ** 20
+
+LOCK_NAME = 'lock'
+
+
+def cache_key(world):
+    """ Get the file name used for a world
+
+    :param world: world.World
+    :return: str
+    """
+    digest = hashlib.sha1(world.to_string().encode())
+    digest.update(struct.pack('<II', CHUNK_SIZE, FORMAT_VERSION))
+    return '{}-{}.chunks'.format(world.rules_version, digest.hexdigest()[:16])
+
+
+def lock(fp, exclusive=True, wait=True):
+    """ Lock an open file, for other processes
+
+    :param exclusive: False for a shared lock
+    :param wait: False to give up if another process has a lock
+    :return: True if locked, or if there is no fcntl
+    """
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not wait:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fp.fileno(), flags)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def unlock(fp):
+    if fcntl is not None:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+def remove_unused(filename):
+    """ Delete a cache file, unless a process has it open
+
+    Hold the lock of the folder, so no process opens it meanwhile.
+
+    :return: True if it was deleted
+    """
+    try:
+        fp = open(filename, 'rb')
+    except OSError:
+        return False
+    with fp:
+        unused = lock(fp, wait=False)
+    if not unused:
+        return False
+    try:
+        os.remove(filename)
+    except OSError:
+        return False
+    return True
+
+
+class ChunkCache(object):
+    """ Chunks saved in a memory mapped file
+
+    :param path: folder for the cache files
+    :param world: world.World
+    :param budget: bytes of cache files in the folder
+    """
+
+    def __init__(self, path, world, budget=CACHE_BUDGET):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.filename = os.path.join(path, cache_key(world))
+        self.budget = budget
+        # records in the file, so that it alone is under the budget
+        self.max_capacity = max((budget - HEADER.size) // RECORD_SIZE, 1)
+        self.index = dict()
+        self.capacity = 0
+        self.count = 0
+        self._map = None
+        self._fp = None
+        self._lock = open(os.path.join(path, LOCK_NAME), 'ab')
+        with self.locked():
+            self.remove_stale(path, world.rules_version)
+            self.open()
+            self.trim()
+
+    @contextmanager
+    def locked(self):
+        """ Hold the lock of the folder; other processes wait for it """
+        lock(self._lock)
+        try:
+            yield
+        finally:
+            unlock(self._lock)
+
+    @staticmethod
+    def remove_stale(path, rules_version):
+        """ Delete cache files made with other rules, unless they are open """
+        prefix = rules_version + '-'
+        for name in os.listdir(path):
+            if name.endswith('.chunks') and not name.startswith(prefix):
+                remove_unused(os.path.join(path, name))
+
+    def trim(self):
+        """ Delete the least recently opened files until the folder is under the budget
+
+        Files that are open, like this one, are kept.  Hold the lock of the
+        folder.
+        """
+        files = list()
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            if name.endswith('.chunks') and filename != self.filename:
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filename))
+        total = os.path.getsize(self.filename) + sum(size for mtime, size, filename in files)
+        for mtime, size, filename in sorted(files):
+            if total <= self.budget:
+                break
+            if remove_unused(filename):
+                total -= size
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def open(self):
+        """ Open the file and read its index; hold the lock of the folder """
+        try:
+            fp = open(self.filename, 'r+b')
+        except FileNotFoundError:
+            fp = open(self.filename, 'w+b')
+        # in use, so other processes do not delete it
+        lock(fp, exclusive=False)
+        # most recently used, for trim
+        os.utime(self.filename)
+
+        self._fp = fp
+        header = fp.read(HEADER.size)
+        if len(header) == HEADER.size:
+            magic, version, size, capacity, count = HEADER.unpack(header)
+            valid = ((magic, version, size) == (MAGIC, FORMAT_VERSION, CHUNK_SIZE) and count <= capacity and
+                     os.fstat(fp.fileno()).st_size >= HEADER.size + capacity * RECORD_SIZE)
+        else:
+            valid = False
+
+        if not valid:
+            # new, damaged, or from another version; start over
+            capacity, count = min(INITIAL_CAPACITY, self.max_capacity), 0
+            fp.truncate(0)
+            fp.truncate(HEADER.size + capacity * RECORD_SIZE)
+            fp.seek(0)
+            fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, CHUNK_SIZE, capacity, count))
+            fp.flush()
+
+        self.capacity = capacity
+        self.count = 0
+        self._map = mmap.mmap(fp.fileno(), 0)
+        self.index = dict()
+        self._read_records(count)
+
+    def close(self):
+        if self._fp is not None:
+            self._map.flush()
+            # the map stays open while chunks are using it
+            self._map = None
+            self._fp.close()
+            self._fp = None
+            self._lock.close()
+
+    def _read_records(self, count):
+        """ Add the records after the ones already read to the index """
+        for slot in range(self.count, count):
+            offset = self._offset(slot)
+            flags, = RECORD_HEADER.unpack_from(self._map, offset)
+            if flags & VALID:
+                header = chunkformat.read_header(self._map, offset + RECORD_HEADER.size)
+                self.index[(header.cx, header.cy)] = slot
+        self.count = count
+
+    def _refresh(self):
+        """ Read the records that other processes added; hold the lock of the folder """
+        magic, version, size, capacity, count = HEADER.unpack_from(self._map, 0)
+        if capacity != self.capacity:
+            # grown by another process
+            self.capacity = capacity
+            self._map = mmap.mmap(self._fp.fileno(), 0)
+        self._read_records(count)
+
+    @staticmethod
+    def _offset(slot):
+        return HEADER.size + slot * RECORD_SIZE
+
+    def _grow(self):
+        self._map.flush()
+        self.capacity = min(self.capacity * 2, self.max_capacity)
+        self._fp.truncate(HEADER.size + self.capacity * RECORD_SIZE)
+        # chunks already loaded keep using the old map
+        self._map = mmap.mmap(self._fp.fileno(), 0)
+        self._write_header()
+        self.trim()
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, FORMAT_VERSION, CHUNK_SIZE, self.capacity, self.count)
+
+    def get(self, cx, cy):
+        """ Get a chunk from the cache
+
+        The chunk arrays are views of the file.
+
+        :return: Chunk, or None if not cached
+        """
+        try:
+            slot = self.index[(cx, cy)]
+        except KeyError:
+            return None
+        return chunkformat.decode_chunk(self._map, self._offset(slot) + RECORD_HEADER.size)[0]
+
+    def put(self, chunk):
+        """ Save a chunk
+
+        Chunks already in the cache are not replaced, and nothing is saved
+        once the file has grown to the budget.
+        """
+        key = chunk.cx, chunk.cy
+        if key in self.index:
+            return
+        with self.locked():
+            self._refresh()
+            if key in self.index:
+                return
+            if self.count == self.capacity:
+                if self.capacity == self.max_capacity:
+                    return
+                self._grow()
+            self._append(key, chunk)
+
+    def _append(self, key, chunk):
+        slot = self.count
+        offset = self._offset(slot)
+        data = self._map
+        RECORD_HEADER.pack_into(data, offset, 0)
+        start = offset + RECORD_HEADER.size
+        data[start:start + chunkformat.RAW_SIZE] = chunkformat.encode_chunk(chunk)
+
+        # mark the record as valid only after it is complete
+        RECORD_HEADER.pack_into(data, offset, VALID)
+        self.count += 1
+        self._write_header()
+        self.index[key] = slot
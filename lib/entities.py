@@ -0,0 +1,316 @@
+""" Entities: wandering NPCs and creatures
+
+Entities are not sprites.  Their positions, velocities and states are rows
+of NumPy arrays, and all of them are updated at once each frame.  A
+spatial hash keyed by chunk, rebuilt after each update, answers which
+entities are in a rect or near a point by looking at the chunks around
+it only.
+
+Only the entities on screen get a sprite: a pool of sprites is handed to
+the pyscroll group each frame, and given the images and positions of the
+visible entities.
+
+Entities only move in chunks that are stored and are not previews, so
+they never make the map generate terrain, and they stop where it has not
+been generated.  Terrain collision is checked at the feet of each entity
+against the tile it is moving onto; WATER and WALL turn it around.
+"""
+import numpy as np
+import pygame
+
+from lib.chunks import CHUNK_SIZE, chunk_range
+from lib.collision import SOLID_BIOMES
+
+# states
+IDLE = 0
+WANDER = 1
+
+# pixels per second
+WANDER_SPEED = 60
+
+# seconds in each state, chosen at random between these
+IDLE_TIME = 1.0, 4.0
+WANDER_TIME = 0.5, 3.0
+
+# tints of the hero image, one per kind of entity
+KIND_COLORS = (
+    (255, 220, 180),
+    (160, 255, 160),
+    (170, 190, 255),
+    (255, 150, 150),
+)
+
+# rows allocated when the arrays are full
+GROWTH = 1024
+
+
+class Entities(object):
+    """ Arrays of entities, updated in one batch
+
+    position is the top left of each entity in pixels, like the position
+    of the Hero, velocity is in pixels per second, state is IDLE or WANDER,
+    and timer the seconds until the state changes.  Only the first count
+    rows are in use; rows are reordered by remove.
+
+    :param terrain: InfiniteMap the entities walk on
+    :param images: image of each kind of entity; all the same size
+    :param seed: seed for the random wandering
+    """
+
+    def __init__(self, terrain, images, seed=None):
+        self.terrain = terrain
+        self.images = images
+        self.size = images[0].get_size()
+        width, height = self.size
+        # the pixel that terrain collision is checked at
+        self.feet = np.array((width // 2, height - 1), dtype=np.float64)
+        self.rng = np.random.default_rng(seed)
+
+        self.count = 0
+        self.position = np.empty((0, 2), dtype=np.float64)
+        self.velocity = np.empty((0, 2), dtype=np.float64)
+        self.state = np.empty(0, dtype=np.uint8)
+        self.timer = np.empty(0, dtype=np.float64)
+        self.kind = np.empty(0, dtype=np.uint8)
+
+        self.cells = dict()
+        self.sprites = list()
+        self.shown = 0
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self, count):
+        capacity = len(self.state)
+        if count <= capacity:
+            return
+        extra = max(count - capacity, GROWTH)
+        self.position = np.concatenate((self.position, np.zeros((extra, 2))))
+        self.velocity = np.concatenate((self.velocity, np.zeros((extra, 2))))
+        self.state = np.concatenate((self.state, np.zeros(extra, dtype=np.uint8)))
+        self.timer = np.concatenate((self.timer, np.zeros(extra)))
+        self.kind = np.concatenate((self.kind, np.zeros(extra, dtype=np.uint8)))
+
+    def spawn(self, positions, kinds):
+        """ Add entities, idle for a moment
+
+        :param positions: (n, 2) array of top left positions, in pixels
+        :param kinds: n indexes of images, or one for all
+        :return: indexes of the new entities
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        start, end = self.count, self.count + len(positions)
+        self._grow(end)
+        self.position[start:end] = positions
+        self.velocity[start:end] = 0
+        self.state[start:end] = IDLE
+        self.timer[start:end] = self.rng.uniform(*IDLE_TIME, size=end - start)
+        self.kind[start:end] = kinds
+        self.count = end
+        self.rehash()
+        return np.arange(start, end)
+
+    def spawn_around(self, center, radius, count, kinds=None):
+        """ Add entities at random tiles near a point that are not solid
+
+        The chunks in the circle are generated if needed.
+
+        :param center: (x, y) in pixels
+        :param radius: in pixels
+        :param count: entities to add; fewer are added if most tiles are solid
+        :param kinds: n indexes of images, or None for random kinds
+        :return: indexes of the new entities
+        """
+        angle = self.rng.uniform(0, 2 * np.pi, count)
+        distance = radius * np.sqrt(self.rng.uniform(0, 1, count))
+        feet = np.stack((np.cos(angle), np.sin(angle)), axis=1) * distance[:, np.newaxis] + center
+        biomes = self.terrain.biome_at(self.tiles_of(feet))
+        keep = ~np.isin(biomes, SOLID_BIOMES)
+        if kinds is None:
+            kinds = self.rng.integers(0, len(self.images), count)
+        kinds = np.broadcast_to(kinds, (count,))[keep]
+        return self.spawn(feet[keep] - self.feet, kinds)
+
+    def remove(self, indexes):
+        """ Remove entities; the indexes of the others may change """
+        keep = np.ones(self.count, dtype=bool)
+        keep[indexes] = False
+        count = int(keep.sum())
+        for array in (self.position, self.velocity, self.state, self.timer, self.kind):
+            array[:count] = array[:self.count][keep]
+        self.count = count
+        self.rehash()
+
+    def scale(self, factor):
+        """ Move every entity as if the map was scaled around its origin """
+        self.position[:self.count] *= factor
+        self.rehash()
+
+    def tiles_of(self, points):
+        """ Get the tiles of points in pixels
+
+        :return: int64 array of (x, y) tiles
+        """
+        return np.floor(points / np.asarray(self.terrain.tile_size, dtype=np.float64)).astype(np.int64)
+
+    def rehash(self):
+        """ Sort the entities into the chunks their feet are in """
+        self.cells = dict(group_by_chunk(self.tiles_of(self.position[:self.count] + self.feet)))
+
+    def in_chunks(self, keys):
+        """ Get the entities whose feet are in some chunks
+
+        :param keys: (chunk_x, chunk_y) iterable
+        :return: indexes
+        """
+        cells = self.cells
+        found = [cells[key] for key in keys if key in cells]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def in_rect(self, rect):
+        """ Get the entities that overlap a rect
+
+        :param rect: (x, y, width, height) in pixels
+        :return: indexes, sorted from top to bottom
+        """
+        x, y, width, height = rect
+        sprite_width, sprite_height = self.size
+        tile_width, tile_height = self.terrain.tile_size
+        # feet outside of the rect can still have a sprite that overlaps it
+        left = int((x - sprite_width) // tile_width)
+        top = int(y // tile_height)
+        right = int((x + width + sprite_width) // tile_width)
+        bottom = int((y + height + sprite_height) // tile_height)
+        found = self.in_chunks(chunk_range(left, top, right - left + 1, bottom - top + 1))
+
+        position = self.position[found]
+        inside = ((position[:, 0] < x + width) & (position[:, 0] + sprite_width > x) &
+                  (position[:, 1] < y + height) & (position[:, 1] + sprite_height > y))
+        found = found[inside]
+        return found[np.argsort(self.position[found, 1], kind='stable')]
+
+    def near(self, point, radius):
+        """ Get the entities whose feet are within a distance of a point
+
+        :param point: (x, y) in pixels
+        :param radius: in pixels
+        :return: indexes
+        """
+        px, py = point
+        tile_width, tile_height = self.terrain.tile_size
+        left, top = int((px - radius) // tile_width), int((py - radius) // tile_height)
+        right, bottom = int((px + radius) // tile_width), int((py + radius) // tile_height)
+        found = self.in_chunks(chunk_range(left, top, right - left + 1, bottom - top + 1))
+        offset = self.position[found] + self.feet - point
+        return found[(offset ** 2).sum(axis=1) <= radius * radius]
+
+    def ready(self, key):
+        """ Check if entities can move in a chunk: it is stored, and not a preview """
+        chunks = self.terrain.chunks
+        return key in chunks and not chunks[key].preview
+
+    def update(self, dt):
+        """ Change states, and move the wandering entities that are awake """
+        count = self.count
+        if not count:
+            return
+        awake = np.zeros(count, dtype=bool)
+        for key, indexes in self.cells.items():
+            if self.ready(key):
+                awake[indexes] = True
+        state = self.state[:count]
+        timer = self.timer[:count]
+        velocity = self.velocity[:count]
+        rng = self.rng
+
+        timer[awake] -= dt
+        changed = np.flatnonzero(awake & (timer <= 0))
+        if len(changed):
+            wander = state[changed] == IDLE
+            state[changed] = np.where(wander, WANDER, IDLE)
+            timer[changed] = np.where(wander, rng.uniform(*WANDER_TIME, len(changed)),
+                                      rng.uniform(*IDLE_TIME, len(changed)))
+            angle = rng.uniform(0, 2 * np.pi, len(changed))
+            speed = np.where(wander, WANDER_SPEED, 0)
+            velocity[changed] = np.stack((np.cos(angle), np.sin(angle)), axis=1) * speed[:, np.newaxis]
+
+        moving = np.flatnonzero(awake & (state == WANDER))
+        if not len(moving):
+            return
+        position = self.position[moving]
+        moved = position + velocity[moving] * dt
+        here = self.tiles_of(position + self.feet)
+        there = self.tiles_of(moved + self.feet)
+
+        # only into chunks that are ready, so no terrain is generated
+        inside = np.zeros(len(moving), dtype=bool)
+        for key, indexes in group_by_chunk(there):
+            if self.ready(key):
+                inside[indexes] = True
+        blocked = np.ones(len(moving), dtype=bool)
+        biomes = self.terrain.biome_at(np.concatenate((here[inside], there[inside])))
+        solid = np.isin(biomes, SOLID_BIOMES).reshape(2, -1)
+        # entities that are stuck in water after a reload may walk out
+        blocked[inside] = solid[1] & ~solid[0]
+
+        self.position[moving[~blocked]] = moved[~blocked]
+        velocity[moving[blocked]] *= -1
+        self.rehash()
+
+    def show(self, group, view):
+        """ Give the pyscroll group a sprite for each entity on screen
+
+        Sprites are reused from frame to frame, and only added to or
+        removed from the group when the number on screen changes.
+
+        :param group: PyscrollGroup
+        :param view: (x, y, width, height) of the screen, in pixels
+        """
+        visible = self.in_rect(view)
+        sprites = self.sprites
+        while len(sprites) < len(visible):
+            sprite = pygame.sprite.Sprite()
+            sprite.rect = pygame.Rect((0, 0), self.size)
+            sprites.append(sprite)
+
+        images = self.images
+        for sprite, position, kind in zip(sprites, self.position[visible].tolist(), self.kind[visible].tolist()):
+            sprite.image = images[kind]
+            sprite.rect.topleft = position
+
+        shown = len(visible)
+        if shown > self.shown:
+            group.add(sprites[self.shown:shown])
+        elif shown < self.shown:
+            group.remove(sprites[shown:self.shown])
+        self.shown = shown
+
+
+def group_by_chunk(tiles):
+    """ Group tiles by the chunk they are in
+
+    :param tiles: int64 array of (x, y) tiles
+    :return: ((chunk_x, chunk_y), indexes) iterator
+    """
+    cx = tiles[:, 0] // CHUNK_SIZE
+    cy = tiles[:, 1] // CHUNK_SIZE
+    # chunk coordinates are far below 2 ** 32
+    keys = (cx << 32) + cy
+    order = np.argsort(keys)
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    for start, end in zip(starts.tolist(), np.append(starts[1:], len(keys)).tolist()):
+        first = order[start]
+        yield (int(cx[first]), int(cy[first])), order[start:end]
+
+
+def tinted_images(image, colors=KIND_COLORS):
+    """ Make one copy of an image for each color, multiplied by it """
+    images = list()
+    for color in colors:
+        tinted = image.copy()
+        tinted.fill(color + (255,), special_flags=pygame.BLEND_RGBA_MULT)
+        images.append(tinted)
+    return images
@@ -0,0 +1,204 @@
+""" Export regions of the world to files
+
+A region is generated in bands of whole chunk rows, by worker processes,
+and handed to the writers one band at a time, in order.  Only a few bands
+are in memory at once, so memory depends on the width of the region, not
+its area.
+"""
+import multiprocessing
+import os
+import struct
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from lib import autotile, fields, generator
+from lib.chunks import CHUNK_SIZE, chunk_rect
+from lib.world import World
+import lib.layers as lib_layers
+import lib.rules as lib_rules
+
+# tiles in each band; a multiple of CHUNK_SIZE
+BAND_HEIGHT = CHUNK_SIZE
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# everything generate_chunk needs besides the chunk coordinates
+Terrain = namedtuple('Terrain', 'world tilesets rules layers')
+
+
+def default_terrain(noise_size=32, seed=None, period=256):
+    """ Get the terrain InfiniteMap makes with the same seed and NOISE_SIZE
+
+    :param noise_size: scale of the streams noise
+    :param seed: noise seed, or None for the default noise
+    :param period: period of the noise
+    :return: Terrain
+    """
+    tilesets = dict(generator.TILESETS)
+    world = World(seed, period, noise_size, generator.rules_version(tilesets))
+    return Terrain(world, tilesets, autotile.compile_rules(lib_rules), fields.compile_layers(lib_layers))
+
+
+def generate_region(x, y, width, height, terrain):
+    """ Generate a rectangle of tiles
+
+    :param x: left tile
+    :param y: top tile
+    :param width: width in tiles
+    :param height: height in tiles
+    :param terrain: Terrain
+    :return: (biome, tiles) arrays, indexed [row, column]
+    """
+    left, top, right, bottom = chunk_rect(x, y, width, height)
+    shape = (bottom - top + 1) * CHUNK_SIZE, (right - left + 1) * CHUNK_SIZE
+    biome = np.empty(shape, dtype=np.uint8)
+    tiles = np.empty(shape, dtype=np.uint16)
+    for cy in range(top, bottom + 1):
+        for cx in range(left, right + 1):
+            chunk = generator.generate_chunk(cx, cy, *terrain)
+            row = (cy - top) * CHUNK_SIZE
+            column = (cx - left) * CHUNK_SIZE
+            biome[row:row + CHUNK_SIZE, column:column + CHUNK_SIZE] = chunk.biome
+            tiles[row:row + CHUNK_SIZE, column:column + CHUNK_SIZE] = chunk.tiles
+
+    ox = x - left * CHUNK_SIZE
+    oy = y - top * CHUNK_SIZE
+    return biome[oy:oy + height, ox:ox + width], tiles[oy:oy + height, ox:ox + width]
+
+
+def bands(y, height, band_height=BAND_HEIGHT):
+    """ Split rows of tiles into bands that start on band_height boundaries
+
+    :return: (top, height) iterator
+    """
+    end = y + height
+    while y < end:
+        next_y = min(end, (y // band_height + 1) * band_height)
+        yield y, next_y - y
+        y = next_y
+
+
+def export_region(x, y, width, height, terrain, writers, band_height=BAND_HEIGHT, workers=None,
+                  progress=None):
+    """ Generate a region and write it band by band
+
+    :param terrain: Terrain
+    :param writers: objects with write(row, biome, tiles); row is from the top of the region
+    :param band_height: tiles in each band; a multiple of CHUNK_SIZE
+    :param workers: worker processes; None for one per cpu, 0 for none
+    :param progress: called with (bands done, bands) after each band
+    """
+    if band_height % CHUNK_SIZE:
+        raise ValueError('band height must be a multiple of {}'.format(CHUNK_SIZE))
+    jobs = list(bands(y, height, band_height))
+
+    def write(index, top, band):
+        for writer in writers:
+            writer.write(top - y, *band)
+        if progress is not None:
+            progress(index + 1, len(jobs))
+
+    if workers == 0:
+        for index, (top, rows) in enumerate(jobs):
+            write(index, top, generate_region(x, top, width, rows, terrain))
+        return
+
+    # workers never touch SDL; spawn so they do not inherit its state
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        # keep a few bands queued for each worker, and no more
+        window = (workers or os.cpu_count() or 1) * 2
+        queued = deque()
+        for index, (top, rows) in enumerate(jobs):
+            queued.append((index, top, executor.submit(generate_region, x, top, width, rows, terrain)))
+            if len(queued) >= window:
+                index, top, future = queued.popleft()
+                write(index, top, future.result())
+        while queued:
+            index, top, future = queued.popleft()
+            write(index, top, future.result())
+
+
+def atlas_tiles(pixels, tile_size, scale):
+    """ Cut an image into tiles, shrinking them to scale x scale pixels
+
+    Tiles are numbered row by row, like InfiniteMap.all_tiles.
+
+    :param pixels: rgb array of the atlas, indexed [y, x, channel]
+    :param tile_size: width and height of a tile in the atlas
+    :param scale: pixels per tile in the output; must divide tile_size
+    :return: uint8 array indexed [tile, y, x, channel]
+    """
+    if scale <= 0 or tile_size % scale:
+        raise ValueError('scale must divide the tile size, {}'.format(tile_size))
+    h, w, channels = pixels.shape
+    rows, columns = h // tile_size, w // tile_size
+    tiles = pixels[:rows * tile_size, :columns * tile_size]
+    tiles = tiles.reshape(rows, tile_size, columns, tile_size, channels).swapaxes(1, 2)
+    factor = tile_size // scale
+    tiles = tiles.reshape(rows * columns, scale, factor, scale, factor, channels).mean(axis=(2, 4))
+    return np.rint(tiles).astype(np.uint8)
+
+
+class NpyWriter(object):
+    """ Writes the biome and tile arrays to <prefix>-biome.npy and <prefix>-tiles.npy
+
+    The files are memory mapped, and can be loaded with numpy.load.
+    """
+
+    def __init__(self, prefix, width, height):
+        self.biome = open_memmap(prefix + '-biome.npy', 'w+', np.uint8, (height, width))
+        self.tiles = open_memmap(prefix + '-tiles.npy', 'w+', np.uint16, (height, width))
+
+    def write(self, row, biome, tiles):
+        self.biome[row:row + len(biome)] = biome
+        self.tiles[row:row + len(tiles)] = tiles
+
+    def close(self):
+        self.biome.flush()
+        self.tiles.flush()
+        self.biome = self.tiles = None
+
+
+class PngWriter(object):
+    """ Writes the tiles as an rgb PNG image, one row of tiles at a time
+
+    :param filename: name of the PNG file
+    :param width: width in tiles
+    :param height: height in tiles
+    :param atlas: tile images from atlas_tiles
+    """
+
+    def __init__(self, filename, width, height, atlas):
+        self.atlas = atlas
+        self.scale = atlas.shape[1]
+        self.width = width
+        self.fp = open(filename, 'wb')
+        self.fp.write(PNG_SIGNATURE)
+        header = struct.pack('>IIBBBBB', width * self.scale, height * self.scale, 8, 2, 0, 0, 0)
+        self._chunk(b'IHDR', header)
+        self.compressor = zlib.compressobj(6)
+
+    def _chunk(self, kind, data):
+        self.fp.write(struct.pack('>I', len(data)) + kind + data)
+        self.fp.write(struct.pack('>I', zlib.crc32(kind + data)))
+
+    def _compressed(self, data):
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def write(self, row, biome, tiles):
+        scale = self.scale
+        line = np.zeros((scale, self.width * scale * 3 + 1), dtype=np.uint8)  # filter type 0
+        for tile_row in tiles:
+            line[:, 1:] = self.atlas[tile_row].swapaxes(0, 1).reshape(scale, -1)
+            self._compressed(self.compressor.compress(line.tobytes()))
+
+    def close(self):
+        self._compressed(self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.fp.close()
@@ -0,0 +1,163 @@
+""" Noise fields for blocks of tiles
+
+The layers described in lib/layers.py are compiled into a LayerGraph.  For
+each block of tiles, the graph makes a Fields object that evaluates layers
+when they are first read, and takes every noise sample only once, however
+many layers use it.
+"""
+from numbers import Real
+
+import numpy as np
+
+# names that can be used as octave scales, and replaced when evaluating
+SCALE_NAMES = ('noise_size',)
+
+
+def _to_range(value, value_range):
+    # same operations for scalars and arrays, so both give the same values
+    low, high = value_range
+    return (value + 1) / 2 * (high - low) + low
+
+
+class LayerGraph(object):
+    """ Noise layers compiled by compile_layers
+
+    layers is a dict of name: (octaves, (low, high)), where octaves is a
+    tuple of (scale, weight), and a scale is a (x, y) pair or a name from
+    SCALE_NAMES.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def octaves(self, name, noise_size):
+        """ Get the octaves of a layer, with named scales replaced
+
+        :param name: layer name
+        :param noise_size: value of the 'noise_size' scale
+        :return: tuple of ((scale x, scale y), weight)
+        """
+        octaves = list()
+        for scale, weight in self.layers[name][0]:
+            if scale == 'noise_size':
+                scale = noise_size, noise_size
+            octaves.append((scale, weight))
+        return tuple(octaves)
+
+    def fields(self, noise, noise_size, x, y, width, height, step=1):
+        """ Get the layers of a rectangle of tiles
+
+        :param noise: SimplexNoise
+        :param noise_size: value of the 'noise_size' scale
+        :param x: left tile
+        :param y: top tile
+        :param width: width in samples
+        :param height: height in samples
+        :param step: tiles between samples
+        :return: Fields
+        """
+        return Fields(self, noise, noise_size, x, y, width, height, step)
+
+    def value(self, noise, noise_size, name, x, y):
+        """ Evaluate one layer for one tile
+
+        Equal to the value Fields gives for the same tile.
+        """
+        noise2 = noise.noise2
+        value = 0.0
+        total = 0.0
+        for (sx, sy), weight in self.octaves(name, noise_size):
+            value += weight * noise2(x / sx, y / sy)
+            total += weight
+        return _to_range(value / total, self.layers[name][1])
+
+
+class Fields(object):
+    """ Layers of a rectangle of tiles, evaluated when first read
+
+    fields[name] is a 2D array of the layer, indexed [row, column].
+    samples holds the noise for each scale that has been sampled.
+
+    Samples are step tiles apart; a step above 1 gives a coarse version of
+    the layers for a larger area.
+    """
+
+    def __init__(self, graph, noise, noise_size, x, y, width, height, step=1):
+        self.graph = graph
+        self.noise = noise
+        self.noise_size = noise_size
+        self.shape = height, width
+        self.xs = (x + step * np.arange(width, dtype=np.float64))[np.newaxis, :]
+        self.ys = (y + step * np.arange(height, dtype=np.float64))[:, np.newaxis]
+        self.values = dict()
+        self.samples = dict()
+
+    def __getitem__(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            value = self.evaluate(name)
+            self.values[name] = value
+            return value
+
+    def sample(self, scale):
+        """ Get the noise at one scale, sampling it only once
+
+        :param scale: (scale x, scale y)
+        :return: 2D array of noise from -1 to 1
+        """
+        try:
+            return self.samples[scale]
+        except KeyError:
+            sx, sy = scale
+            value = self.noise.noise2_array(self.xs / sx, self.ys / sy)
+            self.samples[scale] = value
+            return value
+
+    def evaluate(self, name):
+        value_range = self.graph.layers[name][1]
+        value = np.zeros(self.shape)
+        total = 0.0
+        for scale, weight in self.graph.octaves(name, self.noise_size):
+            value += weight * self.sample(scale)
+            total += weight
+        return _to_range(value / total, value_range)
+
+
+def _check_scale(name, scale):
+    if isinstance(scale, str):
+        if scale not in SCALE_NAMES:
+            raise ValueError('layer {} has unknown scale: {}'.format(name, scale))
+        return scale
+    if isinstance(scale, Real):
+        scale = scale, scale
+    if len(scale) != 2 or not all(isinstance(i, Real) and i > 0 for i in scale):
+        raise ValueError('layer {} has a bad scale: {}'.format(name, scale))
+    return float(scale[0]), float(scale[1])
+
+
+def compile_layers(layers):
+    """ Check the layers of a layers module, and build a LayerGraph
+
+    See lib/layers.py for the format.  Raises ValueError if a layer has no
+    octaves, an unknown or negative scale, weights that add up to 0, or a
+    range that is not (low, high).
+
+    :param layers: module or object with layers
+    :return: LayerGraph
+    """
+    compiled = dict()
+    for name, layer in layers.layers.items():
+        octaves = tuple((_check_scale(name, scale), weight) for scale, weight in layer['octaves'])
+        if not octaves:
+            raise ValueError('layer {} has no octaves'.format(name))
+        if sum(weight for scale, weight in octaves) == 0:
+            raise ValueError('weights of layer {} add up to 0'.format(name))
+        low, high = layer.get('range', (-1, 1))
+        if not low < high:
+            raise ValueError('layer {} has a bad range: {}'.format(name, (low, high)))
+        compiled[name] = octaves, (low, high)
+    return LayerGraph(compiled)
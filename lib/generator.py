@@ -0,0 +1,168 @@
+""" Terrain generation
+
+Functions here only depend on their arguments, so chunks can be generated
+in any order, in any process, and always come out the same.
+"""
+import hashlib
+
+import numpy as np
+
+from lib import autotile
+from lib.chunks import CHUNK_SIZE, Chunk
+import lib.layers as lib_layers
+import lib.rules as lib_rules
+
+GRASS = 1
+LDIRT = 2
+WATER = 4
+WALL = 8
+
+# tile palettes, indexed by tile type; ids are tiles of terrain_atlas.png
+TILESETS = {
+    'ldirt-empty': (112, 49, 48, 80, 17, 111, None, 79, 16, None, 113, 81, 144, 143, 145, 47),
+    'sand-empty': (385, 322, 321, 353, 290, 384, None, 352, 289, None, 386, 354, 417, 416, 418, 320),
+    'water-grass': (391, 328, 327, 359, 296, 390, None, 358, 295, None, 392, 360, 423, 422, 424, 326),
+    'grass': (118, 183, 182, 181, 374),
+    'wall': (38, None, None, 6, 0, 0, 0, 5, 0, 0, 0, 7, 0, 0, 0, 0),
+}
+
+# biomes that use edge tiles: biome, neighbour biome, palette name
+EDGE_TILES = (
+    (WATER, GRASS, 'water-grass'),
+    (LDIRT, GRASS, 'ldirt-empty'),
+)
+
+# change when chunks generated with the same rules would come out different
+GENERATOR_VERSION = 3
+
+# noise generators used by generate_chunk, keyed by (seed, period)
+_noise_cache = dict()
+
+
+def get_noise(world):
+    """ Get the noise generator of a world, reusing old ones
+
+    :param world: world.World
+    :return: SimplexNoise
+    """
+    key = world.seed, world.period
+    try:
+        return _noise_cache[key]
+    except KeyError:
+        noise = world.noise()
+        _noise_cache[key] = noise
+        return noise
+
+
+def rules_version(tilesets):
+    """ Get a short string that changes when the rules or tilesets change
+
+    :param tilesets: dict of tile palettes
+    :return: str
+    """
+    digest = hashlib.sha1(str(GENERATOR_VERSION).encode())
+    for module in (lib_rules, lib_layers):
+        with open(module.__file__, 'rb') as fp:
+            digest.update(fp.read())
+    digest.update(repr(sorted(tilesets.items())).encode())
+    return digest.hexdigest()[:12]
+
+
+def classify(fields, tilesets):
+    """ Choose biomes and base tiles from noise layers
+
+    Only the layers that are read here are evaluated.
+
+    :param fields: fields.Fields, or dict of layer name: array
+    :param tilesets: dict of tile palettes
+    :return: (biome, tiles) arrays
+    """
+    streams = fields['streams']
+    grass_value = fields['grass']
+
+    # elevation = np.rint(fields['elevation']) / 4
+    # biome = np.where(elevation > .999999, WALL, ...)
+
+    biome = np.where(streams >= .80, WATER, np.where(grass_value <= .25, LDIRT, GRASS))
+
+    # round half to even, like round()
+    grass_tiles = np.array(tilesets['grass'], dtype=np.uint16)
+    grass_index = np.rint(grass_value).astype(np.intp)
+    tiles = np.where(biome == GRASS, grass_tiles[grass_index], 0)
+    return biome, tiles
+
+
+def edge_tiles(biome, tiles, tilesets, rules):
+    """ Replace the tiles at biome edges
+
+    The block must have a 1 tile border around the tiles to be changed.
+
+    :param biome: 2D array of biomes
+    :param tiles: 2D array of tiles, same shape as biome
+    :param tilesets: dict of tile palettes
+    :param rules: autotile.RuleTable
+    :return: 2D array of tiles, without the border
+    """
+    inner = biome[1:-1, 1:-1]
+    tiles = tiles[1:-1, 1:-1].copy()
+    scores = dict()
+    for primary, secondary, name in EDGE_TILES:
+        mask = inner == primary
+        if mask.any():
+            if secondary not in scores:
+                scores[secondary] = autotile.score(biome, secondary)
+            lut = autotile.lookup_table(rules, tilesets[name])
+            tiles[mask] = lut[scores[secondary][mask]]
+    return tiles
+
+
+def generate_chunk(cx, cy, world, tilesets, rules, layers):
+    """ Create a chunk and fill it with terrain
+
+    :param cx: chunk x
+    :param cy: chunk y
+    :param world: world.World
+    :param tilesets: dict of tile palettes
+    :param rules: autotile.RuleTable
+    :param layers: fields.LayerGraph
+    :return: Chunk
+    """
+    chunk = Chunk(cx, cy)
+    x, y = chunk.origin
+
+    # generate a 1 tile border, so edges can be scored without the neighbours
+    size = CHUNK_SIZE + 2
+    fields = layers.fields(get_noise(world), world.noise_size, x - 1, y - 1, size, size)
+    biome, tiles = classify(fields, tilesets)
+    chunk.biome[:] = biome[1:-1, 1:-1]
+    chunk.tiles[:] = edge_tiles(biome, tiles, tilesets, rules)
+    return chunk
+
+
+def preview_chunk(cx, cy, world, tilesets, rules, layers, step):
+    """ Create a coarse chunk, quick to make, to show until the real one is done
+
+    The layers are sampled once every step tiles, and each sample fills a
+    step x step block of the chunk.  Edge tiles are chosen from the blocks
+    as usual.
+
+    :param step: tiles between samples; must divide CHUNK_SIZE
+    :return: Chunk, with preview set
+    """
+    chunk = Chunk(cx, cy)
+    x, y = chunk.origin
+
+    # sample the middle of each block, with a 1 block border
+    samples = CHUNK_SIZE // step + 2
+    offset = step // 2 - step
+    fields = layers.fields(get_noise(world), world.noise_size, x + offset, y + offset, samples, samples, step)
+    biome, tiles = classify(fields, tilesets)
+
+    # blocks to tiles, keeping a 1 tile border
+    inner = slice(step - 1, step + CHUNK_SIZE + 1)
+    biome = biome.repeat(step, 0).repeat(step, 1)[inner, inner]
+    tiles = tiles.repeat(step, 0).repeat(step, 1)[inner, inner]
+    chunk.biome[:] = biome[1:-1, 1:-1]
+    chunk.tiles[:] = edge_tiles(biome, tiles, tilesets, rules)
+    chunk.preview = True
+    return chunk
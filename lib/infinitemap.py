@@ -1,98 +1,541 @@
+import logging
+import zlib
+from collections import OrderedDict
 from itertools import product
-from array import array
 
+import numpy as np
 import pygame
 import pyscroll
 
-from lib import perlin
+from lib import autotile, collision, fields, generator, perlin, regions, spatial
+from lib.autotile import POWERS9
+from lib.chunks import (CHUNK_BUDGET, CHUNK_SIZE, ChunkStore, chunk_coords, chunk_range, chunk_rect, chunk_ring,
+                        rect_difference)
+from lib.diskcache import ChunkCache
+from lib.generator import EDGE_TILES
 from lib.resources import load_image
+from lib.timing import NULL_TIMER
+from lib.workers import ChunkPool
+from lib.world import World
+import lib.layers as lib_layers
 import lib.rules as lib_rules
 
+log = logging.getLogger(__name__)
+
 DEBUG_CODES = 0
 
-GRASS = 1
-LDIRT = 2
-WATER = 4
-WALL = 8
+# tile layer with the edge scores, drawn over the terrain when debugging
+DEBUG_LAYER = 1
+
+# score labels kept for the debug layer
+DEBUG_LABELS = 128
+
+# pyscroll needs a map size; tile coordinates beyond it are never drawn
+MAP_SIZE = 2 ** 24
+
+# chunks in the regions of a NOISE_SIZE before they are started over, from
+# the REGION_KEEP most recently used chunks
+REGION_CHUNKS = 16384
+REGION_KEEP = 1024
+
+# chunks around the view that are generated ahead of time, when using workers
+PREFETCH_CHUNKS = 2
+
+# chunk sets kept for recently used values of NOISE_SIZE, and the memory
+# budget of each set that is not in use
+CHUNK_SETS = 4
+SPARE_CHUNK_BUDGET = CHUNK_BUDGET // 4
+
+# tiles between samples of preview chunks; 0 to wait for the real chunks
+PREVIEW_STEP = 4
+
+# pyscroll's clear color for buffers without alpha; changed tiles are
+# cleared with it before they are drawn again
+CLEAR_COLOR = 0, 0, 0
 
-POWERS9 = [1, 2, 4, 8, 16, 32, 64, 128, 256]
-POWERS3 = [64, 128, 256]
+# tile id that no tile has, for tiles that must be drawn again
+NO_TILE = 0xffff
 
 
 class InfiniteMap(pyscroll.PyscrollDataAdapter):
     """ DataAdapter to allow infinite maps rendered by pyscroll
 
     Automatically checks biome boundaries and chooses the best tile
+
+    If workers is not 0, chunks are generated by that many worker processes
+    (None to use one per cpu), and chunks around the view are generated
+    before they are needed.
+
+    While workers generate the chunks in view, coarse preview chunks are
+    shown instead, and replaced on screen as the real ones are finished.
+
+    If cache_dir is set, generated chunks are saved there and loaded again
+    instead of being generated the next time they are needed.
+
+    Chunks are kept for the last few values of NOISE_SIZE, so going back
+    to one with set_noise_size does not generate them again.
+
+    The terrain is made from seed; None for the default noise.  world
+    describes it compactly, for other processes or caches.
+
+    Call close() to stop the workers and close the cache.
+
+    Set timer to a timing.FrameTimer to time preparing and generating
+    chunks.
+
+    Set debug_codes to show the edge score of every edge tile, on a tile
+    layer of its own.  The scores are read from the stored chunks only, so
+    drawing them does not create chunks, count as hits or misses, or change
+    which chunks are least recently used.
+
+    biome_at, nearest and tiles_of answer questions about the terrain
+    for gameplay code, using spatial indexes of the chunks, and region_at
+    tells which lake or dirt patch a tile is part of.  collide_rect and
+    sweep_rect keep sprites off WATER and WALL, using a collision bitmask
+    of each chunk.  They always use the real chunks, never previews.
+
+    After reload, set_noise_size or changing debug_codes, the tiles that
+    pyscroll has drawn are compared with the new ones in the next frame,
+    and only the tiles that changed are drawn again.
     """
 
-    def __init__(self, tile_size=(32, 32)):
+    def __init__(self, tile_size=(32, 32), workers=0, cache_dir=None, seed=None):
         super(InfiniteMap, self).__init__()
         self.NOISE_SIZE = 32
-        self.base_tiler = perlin.SimplexNoise()
+        self.base_tiler = perlin.SimplexNoise(seed=seed)
 
         # required for pyscroll
         self._old_view = None
+
+        # chunk rects that were prepared for the last view
+        self._visible_chunks = None
+        self._prefetch_chunks = None
         self.tile_size = tile_size
-        self.map_size = 1024, 1024
+        self.map_size = MAP_SIZE, MAP_SIZE
         self.visible_tile_layers = [0]
-
-        self.last_value = 0
-        self.last_x = None
-        self.last_y = None
-        self.scan_x = 0
-        self.total_checks = 0
-        self.cached_checks = 0
-
-        self.seen_tiles = set()
-        self.biome_map = [array('B', [0] * 1024) for i in range(1024)]
-        self.tile_map = [array('H', [0] * 1024) for i in range(1024)]
+        self._debug_labels = OrderedDict()
+
+        self.chunk_sets = OrderedDict()
+        self.chunks = None
+        self.region_sets = OrderedDict()
+        self.regions = None
+        self.select_chunks()
+        self.preview_step = PREVIEW_STEP
+        self._refined = set()
+        # chunks whose neighbours' debug scores are drawn again
+        self._ringed = set()
+        self.pool = None if workers == 0 else ChunkPool(workers)
+        self.cache_dir = cache_dir
+        self.cache = None
+        self.timer = NULL_TIMER
 
         self.font = None
 
-        self.tilesets = {
-            'ldirt-empty': (112, 49, 48, 80, 17, 111, None, 79, 16, None, 113, 81, 144, 143, 145, 47),
-            'sand-empty': (385, 322, 321, 353, 290, 384, None, 352, 289, None, 386, 354, 417, 416, 418, 320),
-            'water-grass': (391, 328, 327, 359, 296, 390, None, 358, 295, None, 392, 360, 423, 422, 424, 326),
-            'grass': (118, 183, 182, 181, 374),
-            'wall': (38, None, None, 6, 0, 0, 0, 5, 0, 0, 0, 7, 0, 0, 0, 0),
-        }
+        self.tilesets = dict(generator.TILESETS)
         self.all_tiles = list()
-
+        self.atlas_checksum = None
+        self.clear_tile = None
+        self.rules = None
+        self.rules_version = None
+        self.layers = None
+
+        # tiles drawn before a change, compared with the new ones in the next frame
+        self._drawn = None
+        self.debug_codes = DEBUG_CODES
+
+        self.compile_rules()
+        self.open_cache()
         self.load_texture()
 
+    def get_layer_value(self, name, x, y):
+        return self.layers.value(self.base_tiler, self.NOISE_SIZE, name, x, y)
+
     def get_grass_value(self, x, y):
-        noise = self.base_tiler.noise2
-        grass_value = ((noise(x / self.NOISE_SIZE, y / self.NOISE_SIZE) + 1) / 2) * 4
-        variation = ((noise(x, y) + 1) / 2) * 4
-        return (grass_value * .7) + (variation * .3)
+        return self.get_layer_value('grass', x, y)
+
+    def get_biome(self, x, y):
+        cx, cy, lx, ly = chunk_coords(x, y)
+        return self.chunks.get(cx, cy).biome[ly, lx]
 
-    def score3(self, x, y, secondary):
-        # top, center, bottom tiles
-        tiles = [self.biome_map[y][x] for x, y in ((x, y - 1), (x, y), (x, y + 1))]
-        return sum(i for v, i in zip(tiles, POWERS3) if v == secondary)
+    def get_tile(self, x, y):
+        cx, cy, lx, ly = chunk_coords(x, y)
+        return self.chunks.get(cx, cy).tiles[ly, lx]
+
+    def terrain_chunk(self, cx, cy):
+        """ Get a chunk, waiting for the real one if a preview is stored
+
+        :return: Chunk
+        """
+        chunk = self.chunks.get(cx, cy)
+        if chunk.preview:
+            chunk = self.generate_chunk(cx, cy)
+            self.chunks.put(chunk)
+            self._refined.add((cx, cy))
+        return chunk
+
+    def chunk_index(self, cx, cy):
+        """ Get the spatial.ChunkIndex of a chunk """
+        index = spatial.chunk_index(self.terrain_chunk(cx, cy))
+        # the index counts toward the budget of the chunk set
+        self.chunks.update((cx, cy))
+        return index
+
+    def biome_at(self, points):
+        """ Get the biomes of many tiles at once
+
+        :param points: (x, y) pairs, or an array of shape (n, 2)
+        :return: uint8 array of n biomes
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        cx, lx = np.divmod(points[:, 0], CHUNK_SIZE)
+        cy, ly = np.divmod(points[:, 1], CHUNK_SIZE)
+        result = np.empty(len(points), dtype=np.uint8)
+        if not len(points):
+            return result
+
+        # one lookup per chunk; chunk coordinates are far below 2 ** 32
+        keys = (cx << 32) + cy
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        for start, end in zip(starts, np.append(starts[1:], len(keys))):
+            selected = order[start:end]
+            first = selected[0]
+            biome = self.terrain_chunk(int(cx[first]), int(cy[first])).biome
+            result[selected] = biome[ly[selected], lx[selected]]
+        return result
+
+    def nearest(self, biome, point, max_radius):
+        """ Find the closest tile of a biome
+
+        The chunk of the point answers from its distance transform; other
+        chunks are only searched if they could be closer, nearest first,
+        and skipped if the biome is not in them or its bounding box is too
+        far.  Chunks within max_radius are generated if they do not exist.
+
+        :param biome: biome to look for, like generator.WATER
+        :param point: (x, y) tile
+        :param max_radius: greatest distance, in tiles
+        :return: (x, y) of the closest tile, or None if none is within max_radius
+        """
+        px, py = point
+        pcx, pcy, lx, ly = chunk_coords(px, py)
+        best = None
+        best_distance2 = max_radius * max_radius
+
+        index = self.chunk_index(pcx, pcy)
+        if biome in index.boxes:
+            distance, rows, columns = index.transform(biome)
+            self.chunks.update((pcx, pcy))
+            d = distance[ly, lx]
+            if d * d <= best_distance2:
+                best = pcx * CHUNK_SIZE + int(columns[ly, lx]), pcy * CHUNK_SIZE + int(rows[ly, lx])
+                best_distance2 = d * d
+            # tiles of other chunks are at least this far
+            if d <= min(lx, ly, CHUNK_SIZE - 1 - lx, CHUNK_SIZE - 1 - ly) + 1:
+                return best
+
+        radius = int(max_radius)
+        candidates = list()
+        for cx, cy in chunk_range(px - radius, py - radius, radius * 2 + 1, radius * 2 + 1):
+            if (cx, cy) == (pcx, pcy):
+                continue
+            x, y = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+            distance2 = spatial.box_distance2(px, py, x, y, x + CHUNK_SIZE - 1, y + CHUNK_SIZE - 1)
+            if distance2 <= best_distance2:
+                candidates.append((distance2, cx, cy))
+        candidates.sort()
+
+        for distance2, cx, cy in candidates:
+            if distance2 > best_distance2:
+                break
+            index = self.chunk_index(cx, cy)
+            box = index.boxes.get(biome)
+            if box is None:
+                continue
+            x, y = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+            left, top, right, bottom = box
+            if spatial.box_distance2(px, py, x + left, y + top, x + right, y + bottom) > best_distance2:
+                continue
+            rows, columns = index.cells[biome]
+            distances2 = (columns + (x - px)) ** 2 + (rows + (y - py)) ** 2
+            i = distances2.argmin()
+            if distances2[i] < best_distance2 or best is None and distances2[i] <= best_distance2:
+                best = x + int(columns[i]), y + int(rows[i])
+                best_distance2 = distances2[i]
+        return best
+
+    def tiles_of(self, biome, rect):
+        """ Find every tile of a biome in a rect
+
+        Chunks where the bounding box of the biome is outside the rect are
+        skipped without looking at their tiles.
+
+        :param biome: biome to look for, like generator.WATER
+        :param rect: (x, y, width, height) in tiles
+        :return: int array of shape (n, 2), of (x, y), row by row
+        """
+        x, y, width, height = rect
+        found = list()
+        for cx, cy in chunk_range(x, y, width, height):
+            chunk = self.terrain_chunk(cx, cy)
+            box = spatial.chunk_index(chunk).boxes.get(biome)
+            self.chunks.update((cx, cy))
+            if box is None:
+                continue
+            ox, oy = chunk.origin
+            left, top = max(x, ox + box[0]), max(y, oy + box[1])
+            right, bottom = min(x + width - 1, ox + box[2]), min(y + height - 1, oy + box[3])
+            if right < left or bottom < top:
+                continue
+            block = chunk.biome[top - oy:bottom - oy + 1, left - ox:right - ox + 1]
+            rows, columns = np.nonzero(block == biome)
+            found.append(np.stack((columns + left, rows + top), axis=1))
+
+        if not found:
+            return np.empty((0, 2), dtype=np.int64)
+        found = np.concatenate(found)
+        return found[np.lexsort((found[:, 0], found[:, 1]))]
+
+    def region_at(self, x, y):
+        """ Get the region of WATER or LDIRT that a tile is part of
+
+        The size and extent only count chunks that were generated; if the
+        region is not complete, it reaches chunks that were not.
+
+        :return: regions.Region, or None if the tile is not in a region
+        """
+        cx, cy, lx, ly = chunk_coords(x, y)
+        chunk = self.terrain_chunk(cx, cy)
+        self.add_regions(chunk)
+        label = chunk.labels.labels[ly, lx]
+        if not label:
+            return None
+        return self.regions.region(cx, cy, int(label))
+
+    def solid_columns(self, left, top, right, bottom):
+        """ Find the columns of a rect of tiles that have a solid tile
+
+        :param left: first column
+        :param top: first row
+        :param right: last column, inclusive
+        :param bottom: last row, inclusive
+        :return: int; bit i is set if column left + i has a solid tile
+        """
+        bits = 0
+        for cy in range(top // CHUNK_SIZE, bottom // CHUNK_SIZE + 1):
+            oy = cy * CHUNK_SIZE
+            first, last = max(top, oy) - oy, min(bottom, oy + CHUNK_SIZE - 1) - oy
+            for cx in range(left // CHUNK_SIZE, right // CHUNK_SIZE + 1):
+                rows = collision.collision_mask(self.terrain_chunk(cx, cy))[first:last + 1]
+                row = int(np.bitwise_or.reduce(rows))
+                shift = cx * CHUNK_SIZE - left
+                bits |= row << shift if shift >= 0 else row >> -shift
+        return bits & ((1 << (right - left + 1)) - 1)
+
+    def collide_rect(self, rect):
+        """ Check if a rect touches a solid tile, like WATER or WALL
+
+        :param rect: (x, y, width, height) in pixels
+        :return: bool
+        """
+        x, y, width, height = rect
+        tile_width, tile_height = self.tile_size
+        left, right = collision.tile_span(x, x + width, tile_width)
+        top, bottom = collision.tile_span(y, y + height, tile_height)
+        if right < left or bottom < top:
+            return False
+        return bool(self.solid_columns(left, top, right, bottom))
+
+    def sweep_rect(self, rect, dx, dy):
+        """ Find how far a rect can move before it runs into solid tiles
+
+        Moves along x, then along y from where that ended, so a rect that
+        runs into a wall at an angle slides along it.  Only the tiles that
+        the rect moves into are checked; a rect that already overlaps solid
+        tiles can move out of them.
+
+        :param rect: (x, y, width, height) in pixels
+        :param dx: movement along x, in pixels
+        :param dy: movement along y, in pixels
+        :return: (dx, dy) that the rect can move
+        """
+        x, y, width, height = rect
+        tile_width, tile_height = self.tile_size
+
+        if dx:
+            top, bottom = collision.tile_span(y, y + height, tile_height)
+            if dx > 0:
+                first = collision.tile_span(x, x + width, tile_width)[1] + 1
+                last = collision.tile_span(x, x + width + dx, tile_width)[1]
+                if first <= last:
+                    bits = self.solid_columns(first, top, last, bottom)
+                    if bits:
+                        dx = min(dx, (first + collision.lowest_bit(bits)) * tile_width - (x + width))
+            else:
+                first = collision.tile_span(x + dx, x + width, tile_width)[0]
+                last = collision.tile_span(x, x + width, tile_width)[0] - 1
+                if first <= last:
+                    bits = self.solid_columns(first, top, last, bottom)
+                    if bits:
+                        dx = max(dx, (first + collision.highest_bit(bits) + 1) * tile_width - x)
+
+        if dy:
+            left, right = collision.tile_span(x + dx, x + dx + width, tile_width)
+            if dy > 0:
+                rows = range(collision.tile_span(y, y + height, tile_height)[1] + 1,
+                             collision.tile_span(y, y + height + dy, tile_height)[1] + 1)
+            else:
+                rows = range(collision.tile_span(y, y + height, tile_height)[0] - 1,
+                             collision.tile_span(y + dy, y + height, tile_height)[0] - 1, -1)
+            for row in rows:
+                if self.solid_columns(left, row, right, row):
+                    if dy > 0:
+                        dy = min(dy, row * tile_height - (y + height))
+                    else:
+                        dy = max(dy, (row + 1) * tile_height - y)
+                    break
+
+        return dx, dy
+
+    def peek_biome(self, x, y):
+        """ Get the biome of a tile, only if its chunk is stored
+
+        Unlike get_biome, the chunk is not created, and the store does not
+        count it as used.
+
+        :return: biome, or None
+        """
+        cx, cy, lx, ly = chunk_coords(x, y)
+        try:
+            return self.chunks[cx, cy].biome[ly, lx]
+        except KeyError:
+            return None
 
     def score9(self, x, y, secondary):
         # all surrounding tiles, plus center
-        # unroll loop?
-        tiles = [self.biome_map[y][x] for x, y in ((x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y - 1), (x, y),
-                                                   (x, y + 1), (x + 1, y - 1), (x + 1, y), (x + 1, y + 1))]
+        # same as autotile.score, for one tile; tiles of chunks that are not
+        # stored do not count
+        peek_biome = self.peek_biome
+        tiles = [peek_biome(x, y) for x, y in ((x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y - 1), (x, y),
+                                               (x, y + 1), (x + 1, y - 1), (x + 1, y), (x + 1, y + 1))]
         return sum(i for v, i in zip(tiles, POWERS9) if v == secondary)
 
     def reload(self):
         import importlib
         try:
             importlib.reload(lib_rules)
+            importlib.reload(lib_layers)
         except AttributeError:
             pass
 
+        self.remember_view()
         self._old_view = None
-        self.seen_tiles = set()
+        self._visible_chunks = None
+        self._prefetch_chunks = None
+        self._refined.clear()
+        self._ringed.clear()
+        self.chunk_sets.clear()
+        self.chunks = None
+        self.region_sets.clear()
+        self.select_chunks()
+        if self.pool is not None:
+            self.pool.clear()
+        self.compile_rules()
+        self.open_cache()
         self.load_texture()
 
+    def set_noise_size(self, noise_size):
+        """ Change NOISE_SIZE, keeping the chunks made with the old one
+
+        The tiles that change are drawn again in the next frame.
+        """
+        if noise_size == self.NOISE_SIZE:
+            return
+        self.remember_view()
+        self.NOISE_SIZE = noise_size
+        self._old_view = None
+        self._visible_chunks = None
+        self._prefetch_chunks = None
+        self._refined.clear()
+        self._ringed.clear()
+        if self.pool is not None:
+            self.pool.clear()
+        self.select_chunks()
+        self.open_cache()
+
+    def select_chunks(self):
+        """ Use the chunk set and regions for NOISE_SIZE, making them if needed
+
+        The set that was in use keeps its least recently used chunks, up to
+        SPARE_CHUNK_BUDGET bytes, and the oldest sets are dropped.
+        """
+        old = self.chunks
+        if old is not None:
+            # previews of the old set would never be replaced
+            for key in old:
+                if old[key].preview:
+                    old.discard(key)
+            old.pin(None)
+            old.budget = SPARE_CHUNK_BUDGET
+            old.evict()
+
+        chunk_sets = self.chunk_sets
+        chunks = chunk_sets.pop(self.NOISE_SIZE, None)
+        if chunks is None:
+            chunks = ChunkStore(self.generate_chunk)
+        chunks.budget = CHUNK_BUDGET
+        chunk_sets[self.NOISE_SIZE] = chunks
+        while len(chunk_sets) > CHUNK_SETS:
+            chunk_sets.popitem(last=False)
+        self.chunks = chunks
+
+        region_sets = self.region_sets
+        index = region_sets.pop(self.NOISE_SIZE, None)
+        region_sets[self.NOISE_SIZE] = regions.RegionIndex() if index is None else index
+        while len(region_sets) > CHUNK_SETS:
+            region_sets.popitem(last=False)
+        self.regions = region_sets[self.NOISE_SIZE]
+
+    def compile_rules(self):
+        """ Compile lib.rules and lib.layers
+
+        Checks that every edge palette can use the rules.
+        """
+        self.layers = fields.compile_layers(lib_layers)
+        rules = autotile.compile_rules(lib_rules)
+        for primary, secondary, name in EDGE_TILES:
+            rules.resolve(self.tilesets[name])
+        for corners in rules.gaps:
+            log.warning('no edge tile rule for corners %s', corners)
+        self.rules = rules
+        self.rules_version = generator.rules_version(self.tilesets)
+
+    def open_cache(self):
+        """ Open the chunk cache for the current noise, NOISE_SIZE and rules """
+        if self.cache is not None:
+            self.cache.close()
+        if self.cache_dir is not None:
+            self.cache = ChunkCache(self.cache_dir, self.world)
+
+    def close(self):
+        """ Stop the worker processes and close the cache, if any """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
     def load_texture(self):
         self.font = pygame.font.Font(None, 18)
 
         surface = load_image('terrain_atlas.png').convert_alpha()
+        checksum = zlib.crc32(pygame.image.tostring(surface, 'RGBA'))
+        if checksum != self.atlas_checksum and self._drawn is not None:
+            # the images changed, so every tile has to be drawn again
+            self._drawn[3][:] = NO_TILE
+        self.atlas_checksum = checksum
         tw, th = 32, 32
         sw, sh = surface.get_size()
 
@@ -102,110 +545,358 @@ class InfiniteMap(pyscroll.PyscrollDataAdapter):
         for y, x in product(range(0, sh, th), range(0, sw, tw)):
             append(subsurface((x, y, tw, th)))
 
-    def edge_tile(self, x, y, l, primary, secondary, palette):
-        # determine if the previous score can be reused:
-        # * must be same y as last check
-        # * x must be exactly x+1 as last check
-        # if it cannot be reused, then start check using all surrounding tiles
-        if self.last_y == y:
-            if self.last_x + 1 != x:
-                self.last_value = 0
-                self.scan_x = x
-        else:
-            self.last_value = 0
-            self.last_y = y
-            self.scan_x = x
+        # many tiles are partly transparent, so changed tiles are cleared first
+        self.clear_tile = pygame.Surface((tw, th))
+        self.clear_tile.fill(CLEAR_COLOR)
 
-        self.last_x = x
+    @property
+    def debug_codes(self):
+        return DEBUG_LAYER in self.visible_tile_layers
 
-        self.total_checks += 1
-        if x - self.scan_x == 0:
+    @debug_codes.setter
+    def debug_codes(self, value):
+        if value != self.debug_codes:
+            self.remember_view()
+        self.visible_tile_layers = [0, DEBUG_LAYER] if value else [0]
 
-            # this is a new segment, so scan all tiles
-            self.last_value = self.score9(x, y, secondary)
+    def debug_label(self, score):
+        """ Get an image of a score, rendering it only if it is not cached
 
+        The least recently used labels are discarded, so that at most
+        DEBUG_LABELS are kept.
+        """
+        labels = self._debug_labels
+        try:
+            labels.move_to_end(score)
+            return labels[score]
+        except KeyError:
+            label = self.font.render(str(score), 0, (0, 0, 0))
+            labels[score] = label
+            if len(labels) > DEBUG_LABELS:
+                labels.popitem(last=False)
+            return label
+
+    def debug_tile(self, x, y):
+        """ Get the image of the edge score of a tile, or None
+
+        :return: Surface, or None if the tile is not an edge tile, or its
+                 chunk is not stored
+        """
+        biome = self.peek_biome(x, y)
+        for primary, secondary, name in EDGE_TILES:
+            if biome == primary:
+                break
         else:
-            # able to reuse some of the old score
-            self.cached_checks += 1
+            return None
 
-            # move left
-            self.last_value >>= 3
-            self.last_value += self.score3(x + 1, y, secondary)
+        return self.debug_label(self.score9(x, y, secondary))
 
-        # get the tile type based on the score
-        tile_type = lib_rules.standard8.get(self.last_value, 0)
+    @property
+    def permutation(self):
+        """ Permutation table of the terrain noise, not doubled """
+        return self.base_tiler.permutation[:self.base_tiler.period]
 
-        # get the specific tile image for this cell
-        tile_id = palette[tile_type]
+    @property
+    def world(self):
+        """ Descriptor of the terrain: seed, period, NOISE_SIZE and rules version """
+        return World(self.base_tiler.seed, self.base_tiler.period, self.NOISE_SIZE, self.rules_version)
 
-        # make new image with the score drawn on it
-        if DEBUG_CODES:
-            tile = self.all_tiles[tile_id].copy()
-            text = self.font.render(str(self.last_value), 0, (0, 0, 0))
-            tile.blit(text, (0, 0))
-            tile_id = len(self.all_tiles)
-            self.all_tiles.append(tile)
+    def generate_chunk(self, cx, cy):
+        """ Create a chunk and fill it with terrain
 
-        # set the tile
-        self.tile_map[y][x] = tile_id
+        Loads the chunk from the cache if it is there.  Otherwise, waits
+        for the workers if the chunk is queued, or generates it right here.
+        Then its regions are added and its collision bitmask is made.
 
-    def get_tile_value(self, x, y, l):
-        noise = self.base_tiler.noise2
-        streams = ((noise(x / self.NOISE_SIZE, y / self.NOISE_SIZE) + 1) / 2)
-        grass_value = self.get_grass_value(x, y)
-
-        # elevation = round(((noise(x / 46, y / 32) + 1) / 2) * 4) / 4
-        elevation = 0
+        :param cx: chunk x
+        :param cy: chunk y
+        :return: Chunk
+        """
+        timer = self.timer
+        cache = self.cache
+        chunk = None
+        if cache is not None:
+            with timer.phase('cache'):
+                chunk = cache.get(cx, cy)
+
+        if chunk is None:
+            if self.pool is not None:
+                with timer.phase('wait'):
+                    chunk = self.pool.take(cx, cy)
+            if chunk is None:
+                with timer.phase('generate'):
+                    chunk = generator.generate_chunk(cx, cy, self.world, self.tilesets, self.rules, self.layers)
+            if cache is not None:
+                cache.put(chunk)
+
+        self.add_regions(chunk)
+        collision.collision_mask(chunk)
+        return chunk
+
+    def add_regions(self, chunk):
+        """ Add the regions of a chunk, keeping the index inside REGION_CHUNKS
+
+        The index remembers every chunk it was given, so when it holds more
+        than REGION_CHUNKS it is started over from the REGION_KEEP most
+        recently used chunks that are stored.  Regions that reached the
+        other chunks are smaller, and not complete, until those chunks are
+        generated again.
+        """
+        with self.timer.phase('regions'):
+            index = self.regions
+            if len(index) >= REGION_CHUNKS:
+                index = self.regions = self.region_sets[self.NOISE_SIZE] = regions.RegionIndex()
+                chunks = self.chunks
+                for key in list(chunks)[-REGION_KEEP:]:
+                    if not chunks[key].preview:
+                        index.add_chunk(chunks[key])
+            index.add_chunk(chunk)
+
+    def preview_chunk(self, cx, cy):
+        """ Create a coarse chunk to show until the real one is generated
+
+        :param cx: chunk x
+        :param cy: chunk y
+        :return: Chunk
+        """
+        with self.timer.phase('preview'):
+            return generator.preview_chunk(cx, cy, self.world, self.tilesets, self.rules, self.layers,
+                                           self.preview_step)
 
-        if elevation > .999999:
-            self.biome_map[y][x] = WALL
+    def collect_chunks(self):
+        """ Store the chunks that the workers have finished
 
-        elif streams >= .80:
-            self.biome_map[y][x] = WATER
+        Chunks that replace a preview are remembered, so their tiles can be
+        drawn again.
+        """
+        if self.pool is None:
+            return
+        chunks = self.chunks
+        for chunk in self.pool.collect():
+            key = chunk.cx, chunk.cy
+            if key in chunks and chunks[key].preview:
+                self._refined.add(key)
+            elif key not in chunks and self.debug_codes:
+                self._ringed.add(key)
+            # labeled before it is stored, so the labels are counted
+            self.add_regions(chunk)
+            collision.collision_mask(chunk)
+            chunks.put(chunk)
+            if self.cache is not None:
+                self.cache.put(chunk)
+
+    def get_region(self, x, y, width, height):
+        """ Get the biomes and tiles of a rectangle of tiles
+
+        Chunks that are not stored are created.
+
+        :return: (biome, tiles) arrays, indexed [row, column]
+        """
+        left, top, right, bottom = chunk_rect(x, y, width, height)
+        shape = (bottom - top + 1) * CHUNK_SIZE, (right - left + 1) * CHUNK_SIZE
+        biome = np.empty(shape, dtype=np.uint8)
+        tiles = np.empty(shape, dtype=np.uint16)
+        for cy in range(top, bottom + 1):
+            for cx in range(left, right + 1):
+                chunk = self.chunks.get(cx, cy)
+                row = (cy - top) * CHUNK_SIZE
+                column = (cx - left) * CHUNK_SIZE
+                biome[row:row + CHUNK_SIZE, column:column + CHUNK_SIZE] = chunk.biome
+                tiles[row:row + CHUNK_SIZE, column:column + CHUNK_SIZE] = chunk.tiles
+
+        ox = x - left * CHUNK_SIZE
+        oy = y - top * CHUNK_SIZE
+        return biome[oy:oy + height, ox:ox + width], tiles[oy:oy + height, ox:ox + width]
+
+    def remember_view(self):
+        """ Keep the tiles of the last view, before they are changed
+
+        Call this before anything that can change the tiles on screen; the
+        next frame draws only the tiles that are different.  Tiles that
+        were not drawn yet keep the first tiles that were remembered.
+        """
+        if self._old_view is None or self._drawn is not None or self.chunks is None:
+            return
+        # with a border of one tile, for the edge scores
+        x, y, w, h = self._old_view
+        biome, tiles = self.get_region(x - 1, y - 1, w + 2, h + 2)
+        for cx, cy in self._refined:
+            # replaced previews that are not drawn yet
+            left, top = cx * CHUNK_SIZE - x + 1, cy * CHUNK_SIZE - y + 1
+            tiles[max(top, 0):max(top + CHUNK_SIZE, 0), max(left, 0):max(left + CHUNK_SIZE, 0)] = NO_TILE
+        self._drawn = x - 1, y - 1, biome, tiles, self.debug_codes
+
+    def changed_cells(self, tile_view):
+        """ Find the tiles in view that look different than when remember_view was called
+
+        :param tile_view: Rect of the tiles in pyscroll's buffer
+        :return: bool array, indexed [row, column] from the top left of tile_view
+        """
+        ox, oy, old_biome, old_tiles, old_labels = self._drawn
+        self._drawn = None
+        x, y, w, h = tile_view
+        self.prepare_tiles(tile_view)
+        biome, tiles = self.get_region(x - 1, y - 1, w + 2, h + 2)
+        changed = np.zeros(biome.shape, dtype=bool)
+
+        # only tiles that were on screen can be out of date
+        oh, ow = old_biome.shape
+        left, top = max(x - 1, ox), max(y - 1, oy)
+        right, bottom = min(x + w + 1, ox + ow), min(y + h + 1, oy + oh)
+        if right <= left or bottom <= top:
+            return changed[1:-1, 1:-1]
+        new = slice(top - y + 1, bottom - y + 1), slice(left - x + 1, right - x + 1)
+        old = slice(top - oy, bottom - oy), slice(left - ox, right - ox)
+        changed[new] = tiles[new] != old_tiles[old]
+
+        labels = self.debug_codes
+        if labels and old_labels:
+            # a score depends on the biomes of the 3x3 tiles around it
+            moved = np.zeros(biome.shape, dtype=bool)
+            moved[new] = biome[new] != old_biome[old]
+            spread = moved.copy()
+            spread[1:] |= moved[:-1]
+            spread[:-1] |= moved[1:]
+            moved = spread.copy()
+            spread[:, 1:] |= moved[:, :-1]
+            spread[:, :-1] |= moved[:, 1:]
+            changed |= spread
+        elif labels != old_labels:
+            # labels were added or removed
+            edges = [primary for primary, secondary, name in EDGE_TILES]
+            changed[new] |= np.isin(biome[new], edges) | np.isin(old_biome[old], edges)
+        return changed[1:-1, 1:-1]
+
+    def redraw_rect(self, rect):
+        """ Get the tiles to draw a rect of tiles again, over what is there
+
+        :param rect: (x, y, width, height) in tiles
+        :return: list of (x, y, layer, image)
+        """
+        x, y, w, h = rect
+        clear = self.clear_tile
+        tiles = [(i, j, 0, clear) for j in range(y, y + h) for i in range(x, x + w)]
+        tiles.extend(self.get_tile_images_by_rect(rect))
+        return tiles
 
-        elif grass_value <= .25:
-            self.biome_map[y][x] = LDIRT
+    def changed_tiles(self, tile_view):
+        """ Get the tiles to draw again after a change, one run of changed tiles at a time
 
-        else:
-            self.biome_map[y][x] = GRASS
-            self.tile_map[y][x] = self.tilesets['grass'][int(round(grass_value))]
+        :param tile_view: Rect of the tiles in pyscroll's buffer
+        :return: list of (x, y, layer, image)
+        """
+        with self.timer.phase('redraw'):
+            changed = self.changed_cells(tile_view)
+            tiles = list()
+            x, y = tile_view.topleft
+            for row in np.flatnonzero(changed.any(axis=1)):
+                line = np.concatenate(([False], changed[row], [False]))
+                edges = np.flatnonzero(line[1:] != line[:-1])
+                for start, end in zip(edges[::2], edges[1::2]):
+                    tiles.extend(self.redraw_rect((x + start, y + row, end - start, 1)))
+            return tiles
+
+    def process_animation_queue(self, tile_view):
+        """ Get the tiles of previews that were replaced since the last frame
+
+        pyscroll calls this every frame, and draws the tiles that are
+        returned over the old ones.  This map has no animated tiles, but
+        uses it to draw the tiles that changed since remember_view too.
+
+        :param tile_view: Rect of the tiles in pyscroll's buffer
+        :return: list of (x, y, layer, image)
+        """
+        self.collect_chunks()
+        tiles = list()
+        if self._drawn is not None:
+            tiles.extend(self.changed_tiles(tile_view))
+        if not self._refined and not self._ringed:
+            return tiles
+
+        left, top, right, bottom = chunk_rect(*tile_view)
+        for cx, cy in self._refined:
+            if left <= cx <= right and top <= cy <= bottom and (cx, cy) in self.chunks:
+                x, y = self.chunks[cx, cy].origin
+                tiles.extend(self.redraw_rect(tile_view.clip((x, y, CHUNK_SIZE, CHUNK_SIZE))))
+        if self.debug_codes:
+            # scores of the tiles around a chunk depend on its biomes
+            for key in self._refined | self._ringed:
+                for rect in chunk_ring(*key):
+                    rect = tile_view.clip(rect)
+                    if rect.width and rect.height:
+                        tiles.extend(self.redraw_rect(rect))
+        self._refined.clear()
+        self._ringed.clear()
+        return tiles
+
+    def queue_chunks(self, keys):
+        """ Queue chunks for the workers, unless they are stored or cached
+
+        :param keys: (chunk_x, chunk_y) iterable
+        """
+        chunks = self.chunks
+        cache = () if self.cache is None else self.cache
+        submit = self.pool.submit
+        world = self.world
+        for key in keys:
+            if key not in chunks and key not in cache:
+                submit(key[0], key[1], world, self.tilesets, self.rules, self.layers)
 
     def prepare_tiles(self, view):
+        """ Make sure the chunks in the view exist
+
+        Only chunks that were not in the last view are checked, and the
+        chunks in the view are pinned so they are not discarded.
+        """
+        with self.timer.phase('prepare_tiles'):
+            self._prepare_tiles(view)
+
+    def _prepare_tiles(self, view):
+        self.collect_chunks()
+
         if not view == self._old_view:
             self._old_view = view.copy()
-            x, y, w, h = view
-            seen_tiles = self.seen_tiles
-            seen_add = seen_tiles.add
-            seen_pop = seen_tiles.pop
-            get_tile_value = self.get_tile_value
-
-            for yy, xx in product(range(y - 1, y + h + 1), range(x - 1, x + w + 1)):
-                if (xx, yy) not in seen_tiles:
-                    if len(seen_tiles) > 1024:
-                        seen_pop()
-                    seen_add((xx, yy))
-                    get_tile_value(xx, yy, 0)
-
-    def set_biome(self, x, y):
-        biome = self.biome_map[y][x]
-
-        if biome == WATER:
-            palette = self.tilesets['water-grass']
-            self.edge_tile(x, y, 0, WATER, GRASS, palette)
-
-        elif biome == LDIRT:
-            palette = self.tilesets['ldirt-empty']
-            self.edge_tile(x, y, 0, LDIRT, GRASS, palette)
+            visible = chunk_rect(*view)
+            if visible == self._visible_chunks:
+                return
+
+            if self.pool is not None:
+                # queue the view first, so the workers start on it first
+                left, top, right, bottom = visible
+                prefetch = (left - PREFETCH_CHUNKS, top - PREFETCH_CHUNKS,
+                            right + PREFETCH_CHUNKS, bottom + PREFETCH_CHUNKS)
+                self.queue_chunks(rect_difference(visible, self._visible_chunks))
+                self.queue_chunks(rect_difference(prefetch, self._prefetch_chunks))
+                self._prefetch_chunks = prefetch
+
+            chunks = self.chunks
+            chunks.pin(visible)
+            pending = () if self.pool is None or not self.preview_step else self.pool
+            for key in rect_difference(visible, self._visible_chunks):
+                if self.debug_codes and key not in chunks:
+                    self._ringed.add(key)
+                if key in pending and key not in chunks:
+                    chunks.put(self.preview_chunk(*key))
+                else:
+                    chunks.get(*key)
+            self._visible_chunks = visible
 
     def get_tile_image(self, x, y, l):
         """ Get a tile for the x, y position
 
-        Uses simplex noise to determine what tile to use
+        Tiles are chosen when their chunk is generated, so this only reads
+        them from the chunk
 
         :param x:
         :param y:
         :param l:
         :return:
         """
-        self.set_biome(x, y)
-        return self.all_tiles[self.tile_map[y][x]]
+        if l == DEBUG_LAYER:
+            return self.debug_tile(x, y)
+        cx, cy, lx, ly = chunk_coords(x, y)
+        try:
+            chunk = self.chunks[cx, cy]
+        except KeyError:
+            chunk = self.chunks.get(cx, cy)
+        return self.all_tiles[chunk.tiles[ly, lx]]
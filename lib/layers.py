@@ -0,0 +1,39 @@
+""" Terrain noise layers
+
+Each layer is a weighted sum of noise octaves, mapped from -1..1 to a range
+of values.  An octave is (scale, weight).  Scales are in tiles; a scale can
+be a (x, y) pair to stretch the features, and 'noise_size' stands for
+InfiniteMap.NOISE_SIZE.
+
+Octaves with the same scale are sampled once per chunk and shared by every
+layer that uses them, and a layer is only evaluated if something reads it,
+so unused layers cost nothing.
+
+lib.fields.compile_layers turns these into a LayerGraph.
+"""
+
+layers = {
+    # water where streams >= .8
+    'streams': {
+        'octaves': (('noise_size', 1.0),),
+        'range': (0, 1),
+    },
+
+    # grass tile, and light dirt where grass <= .25
+    'grass': {
+        'octaves': (('noise_size', .7), (1, .3)),
+        'range': (0, 4),
+    },
+
+    # small details, for choosing between tiles of a biome
+    'variation': {
+        'octaves': ((1, 1.0),),
+        'range': (0, 1),
+    },
+
+    # hills; walls where rounded to a quarter it is 4
+    'elevation': {
+        'octaves': (((46, 32), 1.0),),
+        'range': (0, 4),
+    },
+}
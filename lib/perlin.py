@@ -5,9 +5,15 @@
 
 __version__ = '$Id: perlin.py 521 2008-12-15 03:03:52Z casey.duncan $'
 
+import logging
+import os
 from math import floor, fmod, sqrt
 from random import randint
 
+import numpy as np
+
+log = logging.getLogger(__name__)
+
 # 3D Gradient vectors
 _GRAD3 = ((1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
           (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
@@ -42,6 +48,61 @@ _F2 = 0.5 * (sqrt(3.0) - 1.0)
 _G2 = (3.0 - sqrt(3.0)) / 6.0
 _F3 = 1.0 / 3.0
 _G3 = 1.0 / 6.0
+_F4 = (sqrt(5.0) - 1.0) / 4.0
+_G4 = (5.0 - sqrt(5.0)) / 20.0
+
+_pow = np.float_power
+
+# Gradient components as arrays, for the batched noise functions
+_GRAD3_X = np.array([g[0] for g in _GRAD3], dtype=np.float64)
+_GRAD3_Y = np.array([g[1] for g in _GRAD3], dtype=np.float64)
+_GRAD3_Z = np.array([g[2] for g in _GRAD3], dtype=np.float64)
+_GRAD4_ARRAY = np.array(_GRAD4, dtype=np.float64)
+_SIMPLEX_ARRAY = np.array(_SIMPLEX, dtype=np.intp)
+
+# Version of the generator that turns seeds into permutation tables.  The
+# same seed must always give the same table, so never change the algorithm
+# without changing the version.
+PRNG_VERSION = 1
+
+_MASK64 = 2 ** 64 - 1
+
+
+def _splitmix64(seed):
+    """SplitMix64: yield 64 bit random integers from a 64 bit seed"""
+    state = seed
+    while True:
+        state = (state + 0x9E3779B97F4A7C15) & _MASK64
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        yield z ^ (z >> 31)
+
+
+def seeded_permutation(seed, period=256, version=PRNG_VERSION):
+    """Make a permutation table from a seed.
+
+    The table only depends on the seed, period and version; not on the
+    random module or anything else in the process, so every process and
+    host makes the same table.
+
+    seed must be an integer from 0 to 2 ** 64 - 1.
+    """
+    if version != PRNG_VERSION:
+        raise ValueError('unknown permutation generator version {}'.format(version))
+    if not 0 <= seed <= _MASK64:
+        raise ValueError('seed must be from 0 to 2 ** 64 - 1')
+    numbers = _splitmix64(seed)
+    perm = list(range(period))
+    # Fisher-Yates shuffle, with unbiased integers below i + 1
+    for i in range(period - 1, 0, -1):
+        limit = (_MASK64 + 1) // (i + 1) * (i + 1)
+        n = next(numbers)
+        while n >= limit:
+            n = next(numbers)
+        j = n % (i + 1)
+        perm[i], perm[j] = perm[j], perm[i]
+    return tuple(perm)
 
 
 class BaseNoise:
@@ -68,11 +129,17 @@ class BaseNoise:
 
     randint_function = randint
 
-    def __init__(self, period=None, permutation_table=None, randint_function=None):
+    seed = None
+
+    def __init__(self, period=None, permutation_table=None, randint_function=None, seed=None):
         """Initialize the noise generator. With no arguments, the default
         period and permutation table are used (256). The default permutation
         table generates the exact same noise pattern each time.
 
+        An integer seed can be given to make a permutation table from it
+        with seeded_permutation, with the default or the given period.  The
+        same seed and period always make the same noise, in any process.
+
         An integer period can be specified, to generate a random permutation
         table with period elements. The period determines the (integer)
         interval that the noise repeats, which is useful for creating tiled
@@ -88,12 +155,19 @@ class BaseNoise:
         prove useful, they will not be "pure" simplex noise. The largest
         element in the sequence must be no larger than period-1.
 
-        period and permutation_table may not be specified together.
+        period and permutation_table may not be specified together, and
+        seed may not be specified with permutation_table or randint_function.
 
         A substitute for the method random.randint(a, b) can be chosen. The
         method must take two integer parameters a and b and return an integer N
         such that a <= N <= b.
         """
+        if seed is not None:
+            if permutation_table is not None or randint_function is not None:
+                raise ValueError(
+                    'Can not specify seed with permutation_table or randint_function')
+            self.randomize(period, seed)
+            return
         if randint_function is not None:  # do this before calling randomize()
             if not hasattr(randint_function, '__call__'):
                 raise TypeError(
@@ -110,12 +184,19 @@ class BaseNoise:
             self.permutation = tuple(permutation_table) * 2
             self.period = len(permutation_table)
 
-    def randomize(self, period=None):
+    def randomize(self, period=None, seed=None):
         """Randomize the permutation table used by the noise functions. This
         makes them generate a different noise pattern for the same inputs.
+
+        With a seed, the table is made by seeded_permutation instead of
+        randint_function, so it can be made again from the seed.
         """
         if period is not None:
             self.period = period
+        self.seed = seed
+        if seed is not None:
+            self.permutation = seeded_permutation(seed, self.period) * 2
+            return
         perm = list(range(self.period))
         perm_right = self.period - 1
         for i in list(perm):
@@ -123,6 +204,17 @@ class BaseNoise:
             perm[i], perm[j] = perm[j], perm[i]
         self.permutation = tuple(perm) * 2
 
+    def _perm_array(self):
+        """Return the permutation table as a numpy array.
+
+        The array is cached and rebuilt if the permutation table changes.
+        """
+        cached = self.__dict__.get('_perm_cache')
+        if cached is None or cached[0] is not self.permutation:
+            cached = self.permutation, np.array(self.permutation, dtype=np.intp)
+            self._perm_cache = cached
+        return cached[1]
+
 
 class SimplexNoise(BaseNoise):
     """Perlin simplex noise generator
@@ -207,6 +299,64 @@ class SimplexNoise(BaseNoise):
 
         return noise * 70.0  # scale noise to [-1, 1]
 
+    def noise2_array(self, x, y):
+        """2D Perlin simplex noise for arrays of coordinates.
+
+        x and y may be any array-like objects that broadcast together.
+        Return an array of floating point values from -1 to 1; each value is
+        identical to what noise2 returns for the same x, y pair.
+
+        The work is done by the selected backend, see use_backend.
+        """
+        return _kernels['noise2'](self, x, y)
+
+    def _noise2_numpy(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # Skew input space to determine which simplex (triangle) we are in
+        s = (x + y) * _F2
+        i = np.floor(x + s)
+        j = np.floor(y + s)
+        t = (i + j) * _G2
+        x0 = x - (i - t)  # "Unskewed" distances from cell origin
+        y0 = y - (j - t)
+
+        # Lower triangle: i1 = 1, j1 = 0.  Upper triangle: i1 = 0, j1 = 1
+        lower = x0 > y0
+        i1 = lower.astype(np.intp)
+        j1 = 1 - i1
+
+        x1 = x0 - i1 + _G2  # Offsets for middle corner in (x,y) unskewed coords
+        y1 = y0 - j1 + _G2
+        x2 = x0 + _G2 * 2.0 - 1.0  # Offsets for last corner in (x,y) unskewed coords
+        y2 = y0 + _G2 * 2.0 - 1.0
+
+        # Determine hashed gradient indices of the three simplex corners
+        perm = self._perm_array()
+        ii = i.astype(np.int64) % self.period
+        jj = j.astype(np.int64) % self.period
+        gi0 = perm[ii + perm[jj]] % 12
+        gi1 = perm[ii + i1 + perm[jj + j1]] % 12
+        gi2 = perm[ii + 1 + perm[jj + 1]] % 12
+
+        # Calculate the contribution from the three corners
+        noise = _corner2(x0, y0, gi0)
+        noise += _corner2(x1, y1, gi1)
+        noise += _corner2(x2, y2, gi2)
+
+        return noise * 70.0  # scale noise to [-1, 1]
+
+    def noise2_grid(self, x, y, width, height, scale=1):
+        """2D Perlin simplex noise for a rectangle of integer coordinates.
+
+        Return an array of shape (height, width), indexed [row, column],
+        where each value equals noise2((x + column) / scale, (y + row) / scale).
+        """
+        xs = np.arange(x, x + width, dtype=np.float64) / scale
+        ys = np.arange(y, y + height, dtype=np.float64) / scale
+        return self.noise2_array(xs[np.newaxis, :], ys[:, np.newaxis])
+
     def noise3(self, x, y, z):
         """3D Perlin simplex noise.
 
@@ -318,6 +468,157 @@ class SimplexNoise(BaseNoise):
 
         return noise * 32.0
 
+    def noise4(self, x, y, z, w):
+        """4D Perlin simplex noise.
+
+        Return a floating point value from -1 to 1 for the given x, y, z, w coordinate.
+        The same value is always returned for a given x, y, z, w pair unless the
+        permutation table changes (see randomize above).
+        """
+        # Skew the (x,y,z,w) space to determine which cell of 24 simplices we're in
+        s = (x + y + z + w) * _F4
+        i = floor(x + s)
+        j = floor(y + s)
+        k = floor(z + s)
+        l = floor(w + s)
+        t = (i + j + k + l) * _G4
+        x0 = x - (i - t)  # "Unskewed" distances from cell origin
+        y0 = y - (j - t)
+        z0 = z - (k - t)
+        w0 = w - (l - t)
+
+        # The order of the magnitudes of x0, y0, z0 and w0 determines which
+        # simplex we are in.  Rank them with six pair-wise comparisons, and
+        # use the result as an index into the _SIMPLEX traversal table.
+        c = ((x0 > y0) * 32 + (x0 > z0) * 16 + (y0 > z0) * 8 +
+             (x0 > w0) * 4 + (y0 > w0) * 2 + (z0 > w0))
+        sc = _SIMPLEX[c]
+
+        # The largest magnitude coordinate is stepped first, then the second
+        # largest, and so on.
+        i1, j1, k1, l1 = (int(v >= 3) for v in sc)
+        i2, j2, k2, l2 = (int(v >= 2) for v in sc)
+        i3, j3, k3, l3 = (int(v >= 1) for v in sc)
+
+        # Offsets for remaining corners
+        x1 = x0 - i1 + _G4
+        y1 = y0 - j1 + _G4
+        z1 = z0 - k1 + _G4
+        w1 = w0 - l1 + _G4
+        x2 = x0 - i2 + 2.0 * _G4
+        y2 = y0 - j2 + 2.0 * _G4
+        z2 = z0 - k2 + 2.0 * _G4
+        w2 = w0 - l2 + 2.0 * _G4
+        x3 = x0 - i3 + 3.0 * _G4
+        y3 = y0 - j3 + 3.0 * _G4
+        z3 = z0 - k3 + 3.0 * _G4
+        w3 = w0 - l3 + 3.0 * _G4
+        x4 = x0 - 1.0 + 4.0 * _G4
+        y4 = y0 - 1.0 + 4.0 * _G4
+        z4 = z0 - 1.0 + 4.0 * _G4
+        w4 = w0 - 1.0 + 4.0 * _G4
+
+        # Calculate the hashed gradient indices of the five simplex corners
+        perm = self.permutation
+        ii = int(i) % self.period
+        jj = int(j) % self.period
+        kk = int(k) % self.period
+        ll = int(l) % self.period
+        gi0 = perm[ii + perm[jj + perm[kk + perm[ll]]]] % 32
+        gi1 = perm[ii + i1 + perm[jj + j1 + perm[kk + k1 + perm[ll + l1]]]] % 32
+        gi2 = perm[ii + i2 + perm[jj + j2 + perm[kk + k2 + perm[ll + l2]]]] % 32
+        gi3 = perm[ii + i3 + perm[jj + j3 + perm[kk + k3 + perm[ll + l3]]]] % 32
+        gi4 = perm[ii + 1 + perm[jj + 1 + perm[kk + 1 + perm[ll + 1]]]] % 32
+
+        # Calculate the contribution from the five corners
+        noise = 0.0
+        for gi, cx, cy, cz, cw in ((gi0, x0, y0, z0, w0), (gi1, x1, y1, z1, w1), (gi2, x2, y2, z2, w2),
+                                   (gi3, x3, y3, z3, w3), (gi4, x4, y4, z4, w4)):
+            tt = 0.6 - cx ** 2 - cy ** 2 - cz ** 2 - cw ** 2
+            if tt > 0:
+                g = _GRAD4[gi]
+                noise += tt ** 4 * (g[0] * cx + g[1] * cy + g[2] * cz + g[3] * cw)
+
+        return noise * 27.0
+
+    def noise4_array(self, x, y, z, w):
+        """4D Perlin simplex noise for arrays of coordinates.
+
+        x, y, z and w may be any array-like objects that broadcast together,
+        so animated noise can be sampled for just the points that need it,
+        with z or w as time.  Each value is identical to what noise4 returns
+        for the same x, y, z, w coordinate.
+
+        The work is done by the selected backend, see use_backend.
+        """
+        return _kernels['noise4'](self, x, y, z, w)
+
+    def _noise4_numpy(self, x, y, z, w):
+        x, y, z, w = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (x, y, z, w)))
+
+        # Skew the (x,y,z,w) space to determine which cell of 24 simplices we're in
+        s = (x + y + z + w) * _F4
+        i = np.floor(x + s)
+        j = np.floor(y + s)
+        k = np.floor(z + s)
+        l = np.floor(w + s)
+        t = (i + j + k + l) * _G4
+        x0 = x - (i - t)  # "Unskewed" distances from cell origin
+        y0 = y - (j - t)
+        z0 = z - (k - t)
+        w0 = w - (l - t)
+
+        # Rank the coordinates to find the simplex, see noise4
+        c = ((x0 > y0) * 32 + (x0 > z0) * 16 + (y0 > z0) * 8 +
+             (x0 > w0) * 4 + (y0 > w0) * 2 + (z0 > w0) * 1)
+        sc = _SIMPLEX_ARRAY[c]
+        step1 = (sc >= 3).astype(np.intp)
+        step2 = (sc >= 2).astype(np.intp)
+        step3 = (sc >= 1).astype(np.intp)
+
+        # Hashed gradient index of a corner, offset from the cell origin
+        perm = self._perm_array()
+        ii = i.astype(np.int64) % self.period
+        jj = j.astype(np.int64) % self.period
+        kk = k.astype(np.int64) % self.period
+        ll = l.astype(np.int64) % self.period
+
+        def gradient_index(di, dj, dk, dl):
+            return perm[ii + di + perm[jj + dj + perm[kk + dk + perm[ll + dl]]]] % 32
+
+        # Calculate the contribution from the five corners
+        noise = _corner4(x0, y0, z0, w0, gradient_index(0, 0, 0, 0))
+        for n, step in ((1, step1), (2, step2), (3, step3)):
+            si, sj, sk, sl = (step[..., axis] for axis in range(4))
+            noise += _corner4(x0 - si + n * _G4, y0 - sj + n * _G4, z0 - sk + n * _G4, w0 - sl + n * _G4,
+                              gradient_index(si, sj, sk, sl))
+        noise += _corner4(x0 - 1.0 + 4.0 * _G4, y0 - 1.0 + 4.0 * _G4, z0 - 1.0 + 4.0 * _G4, w0 - 1.0 + 4.0 * _G4,
+                          gradient_index(1, 1, 1, 1))
+
+        return noise * 27.0
+
+
+def _corner2(x, y, gi):
+    """Contribution of one simplex corner to batched 2D noise"""
+    # float_power calls the same libm pow() as the scalar ** operator; numpy's
+    # own ** takes shortcuts that differ from it in the last bit
+    tt = 0.5 - _pow(x, 2) - _pow(y, 2)
+    return np.where(tt > 0, _pow(tt, 4) * (_GRAD3_X[gi] * x + _GRAD3_Y[gi] * y), 0.0)
+
+
+def _corner4(x, y, z, w, gi):
+    """Contribution of one simplex corner to batched 4D noise"""
+    tt = 0.6 - _pow(x, 2) - _pow(y, 2) - _pow(z, 2) - _pow(w, 2)
+    g = _GRAD4_ARRAY[gi]
+    dot = g[..., 0] * x + g[..., 1] * y + g[..., 2] * z + g[..., 3] * w
+    return np.where(tt > 0, _pow(tt, 4) * dot, 0.0)
+
+
+def _grad3(hash, x, y, z):
+    """grad3 for arrays of hashes and coordinates"""
+    g = hash % 16
+    return x * _GRAD3_X[g] + y * _GRAD3_Y[g] + z * _GRAD3_Z[g]
+
 
 def lerp(t, a, b):
     return a + t * (b - a)
@@ -382,6 +683,300 @@ class TileableNoise(BaseNoise):
                          lerp(fx, grad3(perm[AB + kk], x, y - 1, z - 1),
                               grad3(perm[BB + kk], x - 1, y - 1, z - 1))))
 
+    def noise3_array(self, x, y, z, repeat, base=0):
+        """Tileable 3D noise for arrays of coordinates.
+
+        x, y and z may be any array-like objects that broadcast together.
+        Each value is identical to what noise3 returns for the same
+        coordinate.
+
+        The work is done by the selected backend, see use_backend.
+        """
+        return _kernels['tileable3'](self, x, y, z, repeat, base)
+
+    def _noise3_numpy(self, x, y, z, repeat, base=0):
+        x, y, z = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (x, y, z)))
+        fx0 = np.floor(x)
+        fy0 = np.floor(y)
+        fz0 = np.floor(z)
+        i = np.fmod(fx0, repeat).astype(np.intp)
+        j = np.fmod(fy0, repeat).astype(np.intp)
+        k = np.fmod(fz0, repeat).astype(np.intp)
+        ii = (i + 1) % repeat
+        jj = (j + 1) % repeat
+        kk = (k + 1) % repeat
+        if base:
+            i += base
+            j += base
+            k += base
+            ii += base
+            jj += base
+            kk += base
+
+        x = x - fx0
+        y = y - fy0
+        z = z - fz0
+        fx = _pow(x, 3) * (x * (x * 6 - 15) + 10)
+        fy = _pow(y, 3) * (y * (y * 6 - 15) + 10)
+        fz = _pow(z, 3) * (z * (z * 6 - 15) + 10)
+
+        perm = self._perm_array()
+        A = perm[i]
+        AA = perm[A + j]
+        AB = perm[A + jj]
+        B = perm[ii]
+        BA = perm[B + j]
+        BB = perm[B + jj]
+
+        return lerp(fz, lerp(fy, lerp(fx, _grad3(perm[AA + k], x, y, z),
+                                      _grad3(perm[BA + k], x - 1, y, z)),
+                             lerp(fx, _grad3(perm[AB + k], x, y - 1, z),
+                                  _grad3(perm[BB + k], x - 1, y - 1, z))),
+                    lerp(fy, lerp(fx, _grad3(perm[AA + kk], x, y, z - 1),
+                                  _grad3(perm[BA + kk], x - 1, y, z - 1)),
+                         lerp(fx, _grad3(perm[AB + kk], x, y - 1, z - 1),
+                              _grad3(perm[BB + kk], x - 1, y - 1, z - 1))))
+
+    def noise3_grid(self, width, height, repeat, z=0.0, base=0):
+        """Tileable 3D noise for one seamless slice of the pattern.
+
+        Return an array of shape (height, width), indexed [row, column],
+        that covers one repeat interval in x and y at depth z, so copies of
+        it placed side by side have no seams. z may also be a sequence, to
+        get a volume of shape (len(z), height, width).
+        """
+        xs = np.arange(width, dtype=np.float64) * repeat / width
+        ys = np.arange(height, dtype=np.float64) * repeat / height
+        z = np.asarray(z, dtype=np.float64)
+        zs = z.reshape(z.shape + (1, 1))
+        return self.noise3_array(xs[np.newaxis, :], ys[:, np.newaxis], zs, repeat, base)
+
+
+class FractalNoise:
+    """Fractal noise: a weighted sum of several octaves of another noise.
+
+    By default this is fractal Brownian motion; each octave is sampled at
+    1 / lacunarity the scale of the one before it, and weighted by gain
+    times the weight of the one before it.
+
+    A stack of (scale, weight) pairs can be given instead, to describe the
+    octaves directly. Coordinates are divided by the scale of each octave.
+
+    Values are divided by the total weight, so they range from -1 to 1.
+    """
+
+    def __init__(self, noise=None, octaves=4, lacunarity=2.0, gain=0.5, scale=1.0, stack=None):
+        """Initialize the fractal noise generator.
+
+        noise is the SimplexNoise instance sampled for every octave; a new
+        one with the default permutation table is used if it is not given.
+        """
+        if noise is None:
+            noise = SimplexNoise()
+        if stack is None:
+            stack = [(scale / lacunarity ** i, gain ** i) for i in range(octaves)]
+        if not stack:
+            raise ValueError('at least one octave is required')
+        self.noise = noise
+        self.stack = tuple((scale, weight) for scale, weight in stack)
+        self.total_weight = sum(weight for scale, weight in self.stack)
+
+    def noise2(self, x, y):
+        """2D fractal noise.
+
+        Return a floating point value from -1 to 1 for the given x, y coordinate.
+        """
+        noise = self.noise.noise2
+        value = 0.0
+        for scale, weight in self.stack:
+            value += weight * noise(x / scale, y / scale)
+        return value / self.total_weight
+
+    def noise2_array(self, x, y):
+        """2D fractal noise for arrays of coordinates.
+
+        All octaves are sampled with one call to noise2_array. Each value is
+        identical to what noise2 returns for the same x, y pair.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        scales = np.array([scale for scale, weight in self.stack], dtype=np.float64)
+        scales = scales.reshape((-1,) + (1,) * x.ndim)
+        octaves = self.noise.noise2_array(x / scales, y / scales)
+
+        value = np.zeros(x.shape)
+        for (scale, weight), octave in zip(self.stack, octaves):
+            value += weight * octave
+        return value / self.total_weight
+
+    def noise2_grid(self, x, y, width, height, scale=1):
+        """2D fractal noise for a rectangle of integer coordinates.
+
+        Return an array of shape (height, width), indexed [row, column],
+        where each value equals noise2((x + column) / scale, (y + row) / scale).
+        """
+        xs = np.arange(x, x + width, dtype=np.float64) / scale
+        ys = np.arange(y, y + height, dtype=np.float64) / scale
+        return self.noise2_array(xs[np.newaxis, :], ys[:, np.newaxis])
+
+
+# Backends of the array methods.  Every backend must give exactly the same
+# values as the pure python methods; backends that do not are disabled when
+# this module is imported.
+
+# environment variable naming the backend to use
+BACKEND_VARIABLE = 'WORLD_GEN_NOISE'
+
+# backends, fastest first
+BACKEND_ORDER = ('numba', 'numpy', 'python')
+
+# kernels of the backends that passed the check, by backend name
+_backends = dict()
+
+# name and kernels of the backend in use
+backend = None
+_kernels = None
+
+
+def _flat_arrays(*values):
+    """Broadcast array-likes together, as contiguous flat float64 arrays"""
+    arrays = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in values))
+    return arrays[0].shape, [np.ascontiguousarray(a).ravel() for a in arrays]
+
+
+def _python_kernel(method):
+    """Make a kernel that calls a pure python method for every value"""
+
+    def kernel(noise, *args):
+        coordinates = len(args) - 2 if method == 'noise3' else len(args)
+        shape, arrays = _flat_arrays(*args[:coordinates])
+        function = getattr(noise, method)
+        extra = args[coordinates:]
+        values = [function(*point, *extra) for point in zip(*(a.tolist() for a in arrays))]
+        return np.array(values, dtype=np.float64).reshape(shape)
+
+    return kernel
 
 
+_NUMPY_KERNELS = {
+    'noise2': SimplexNoise._noise2_numpy,
+    'noise4': SimplexNoise._noise4_numpy,
+    'tileable3': TileableNoise._noise3_numpy,
+}
 
+_PYTHON_KERNELS = {
+    'noise2': _python_kernel('noise2'),
+    'noise4': _python_kernel('noise4'),
+    'tileable3': _python_kernel('noise3'),
+}
+
+
+def _numba_kernels():
+    """Get kernels that run the numba loops, or raise ImportError"""
+    from lib import perlin_numba
+
+    grad3 = np.array(_GRAD3, dtype=np.float64)
+
+    def noise2(noise, x, y):
+        shape, (x, y) = _flat_arrays(x, y)
+        out = np.empty(x.size)
+        perlin_numba.noise2(noise._perm_array(), noise.period, grad3, _F2, _G2, x, y, out)
+        return out.reshape(shape)
+
+    def noise4(noise, x, y, z, w):
+        shape, (x, y, z, w) = _flat_arrays(x, y, z, w)
+        out = np.empty(x.size)
+        perlin_numba.noise4(noise._perm_array(), noise.period, _GRAD4_ARRAY, _SIMPLEX_ARRAY, _F4, _G4,
+                            x, y, z, w, out)
+        return out.reshape(shape)
+
+    def tileable3(noise, x, y, z, repeat, base=0):
+        shape, (x, y, z) = _flat_arrays(x, y, z)
+        out = np.empty(x.size)
+        perlin_numba.tileable3(noise._perm_array(), grad3, int(repeat), int(base), x, y, z, out)
+        return out.reshape(shape)
+
+    return {'noise2': noise2, 'noise4': noise4, 'tileable3': tileable3}
+
+
+def _check_kernels(kernels):
+    """Compare kernels with the pure python methods
+
+    :return: description of the first difference, or None
+    """
+    xs = np.linspace(-70.5, 70.25, 17)[np.newaxis, :]
+    ys = np.linspace(-33.3, 91.7, 13)[:, np.newaxis]
+    simplex = SimplexNoise()
+    tileable = TileableNoise()
+    checks = (
+        ('noise2', simplex, (xs, ys), (xs / 7.3, ys / 3.1)),
+        ('noise4', simplex, (xs / 9.1, ys / 4.3, .37, -1.9), (xs, 1.5, ys, 2.25)),
+        ('tileable3', tileable, (xs / 5.7, ys / 4.9, .3, 8), (xs / 3.3, ys / 6.1, 2.5, 4, 32)),
+    )
+    for name, noise, *cases in checks:
+        for args in cases:
+            expected = _PYTHON_KERNELS[name](noise, *args)
+            try:
+                got = kernels[name](noise, *args)
+            except Exception as e:
+                return '{} raised {!r}'.format(name, e)
+            if not np.array_equal(got, expected):
+                return '{} differs from the pure python noise'.format(name)
+    return None
+
+
+def register_backend(name, kernels):
+    """Add a backend for the array methods, if it gives the right values
+
+    kernels is a dict of functions that take the noise object and the
+    arguments of noise2_array ('noise2'), noise4_array ('noise4') or
+    TileableNoise.noise3_array ('tileable3').  Missing kernels use numpy.
+
+    :return: True if the backend can be used
+    """
+    kernels = dict(_NUMPY_KERNELS, **kernels)
+    problem = _check_kernels(kernels)
+    if problem is not None:
+        log.warning('noise backend %s is disabled: %s', name, problem)
+        return False
+    _backends[name] = kernels
+    return True
+
+
+def available_backends():
+    """Names of the backends that can be used, fastest first"""
+    return [name for name in BACKEND_ORDER if name in _backends] + \
+           [name for name in _backends if name not in BACKEND_ORDER]
+
+
+def use_backend(name=None):
+    """Choose the backend for the array methods
+
+    Without a name, the backend named by the WORLD_GEN_NOISE environment
+    variable is used if it is available, or else the fastest one.  All
+    backends give the same values, so the choice only changes the speed.
+
+    :param name: 'numba', 'numpy' or 'python'
+    """
+    global backend, _kernels
+    if name is None:
+        name = os.environ.get(BACKEND_VARIABLE) or None
+        if name is not None and name not in _backends:
+            log.warning('noise backend %s from %s is not available, using %s',
+                        name, BACKEND_VARIABLE, available_backends()[0])
+            name = None
+    if name is None:
+        name = available_backends()[0]
+    elif name not in _backends:
+        raise ValueError('noise backend {} is not available; choose from {}'.format(name, available_backends()))
+    backend = name
+    _kernels = _backends[name]
+
+
+# the pure python methods are the reference, so they are not checked
+_backends['python'] = _PYTHON_KERNELS
+register_backend('numpy', {})
+try:
+    register_backend('numba', _numba_kernels())
+except ImportError:
+    pass
+use_backend()
@@ -0,0 +1,192 @@
+""" Noise kernels compiled with numba
+
+Used by lib.perlin as the 'numba' backend.  Each kernel is a loop over
+flat arrays that does the same operations as the pure python methods of
+lib.perlin, in the same order, so the results are identical.
+
+Powers call libm's pow() through ctypes, like python's ** operator does.
+numba's own pow is replaced by a multiplication for some exponents, which
+can differ in the last bit.  Kernels that use a ctypes function can not be
+cached, so they are compiled every time the module is imported.
+
+Importing this module raises ImportError if numba or libm is not found.
+"""
+import ctypes
+import ctypes.util
+import math
+
+import numpy as np
+from numba import njit
+
+_libm = ctypes.util.find_library('m')
+if _libm is None:
+    raise ImportError('libm not found')
+_pow = ctypes.CDLL(_libm).pow
+_pow.restype = ctypes.c_double
+_pow.argtypes = ctypes.c_double, ctypes.c_double
+
+
+@njit
+def noise2(perm, period, grad3, f2, g2, x, y, out):
+    for n in range(x.size):
+        xn = x[n]
+        yn = y[n]
+        s = (xn + yn) * f2
+        i = math.floor(xn + s)
+        j = math.floor(yn + s)
+        t = (i + j) * g2
+        x0 = xn - (i - t)
+        y0 = yn - (j - t)
+
+        if x0 > y0:
+            i1 = 1
+            j1 = 0
+        else:
+            i1 = 0
+            j1 = 1
+
+        x1 = x0 - i1 + g2
+        y1 = y0 - j1 + g2
+        x2 = x0 + g2 * 2.0 - 1.0
+        y2 = y0 + g2 * 2.0 - 1.0
+
+        ii = np.int64(i) % period
+        jj = np.int64(j) % period
+        gi0 = perm[ii + perm[jj]] % 12
+        gi1 = perm[ii + i1 + perm[jj + j1]] % 12
+        gi2 = perm[ii + 1 + perm[jj + 1]] % 12
+
+        tt = 0.5 - _pow(x0, 2.0) - _pow(y0, 2.0)
+        if tt > 0:
+            noise = _pow(tt, 4.0) * (grad3[gi0, 0] * x0 + grad3[gi0, 1] * y0)
+        else:
+            noise = 0.0
+
+        tt = 0.5 - _pow(x1, 2.0) - _pow(y1, 2.0)
+        if tt > 0:
+            noise += _pow(tt, 4.0) * (grad3[gi1, 0] * x1 + grad3[gi1, 1] * y1)
+
+        tt = 0.5 - _pow(x2, 2.0) - _pow(y2, 2.0)
+        if tt > 0:
+            noise += _pow(tt, 4.0) * (grad3[gi2, 0] * x2 + grad3[gi2, 1] * y2)
+
+        out[n] = noise * 70.0
+
+
+@njit
+def _corner4(grad4, gi, x, y, z, w):
+    tt = 0.6 - _pow(x, 2.0) - _pow(y, 2.0) - _pow(z, 2.0) - _pow(w, 2.0)
+    if tt > 0:
+        return _pow(tt, 4.0) * (grad4[gi, 0] * x + grad4[gi, 1] * y + grad4[gi, 2] * z + grad4[gi, 3] * w)
+    return 0.0
+
+
+@njit
+def noise4(perm, period, grad4, simplex, f4, g4, x, y, z, w, out):
+    for n in range(x.size):
+        xn = x[n]
+        yn = y[n]
+        zn = z[n]
+        wn = w[n]
+        s = (xn + yn + zn + wn) * f4
+        i = math.floor(xn + s)
+        j = math.floor(yn + s)
+        k = math.floor(zn + s)
+        l = math.floor(wn + s)
+        t = (i + j + k + l) * g4
+        x0 = xn - (i - t)
+        y0 = yn - (j - t)
+        z0 = zn - (k - t)
+        w0 = wn - (l - t)
+
+        c = 0
+        if x0 > y0:
+            c += 32
+        if x0 > z0:
+            c += 16
+        if y0 > z0:
+            c += 8
+        if x0 > w0:
+            c += 4
+        if y0 > w0:
+            c += 2
+        if z0 > w0:
+            c += 1
+
+        ii = np.int64(i) % period
+        jj = np.int64(j) % period
+        kk = np.int64(k) % period
+        ll = np.int64(l) % period
+
+        gi = perm[ii + perm[jj + perm[kk + perm[ll]]]] % 32
+        noise = _corner4(grad4, gi, x0, y0, z0, w0)
+        for m in range(1, 4):
+            # the largest magnitude coordinate is stepped first
+            si = 1 if simplex[c, 0] >= 4 - m else 0
+            sj = 1 if simplex[c, 1] >= 4 - m else 0
+            sk = 1 if simplex[c, 2] >= 4 - m else 0
+            sl = 1 if simplex[c, 3] >= 4 - m else 0
+            gi = perm[ii + si + perm[jj + sj + perm[kk + sk + perm[ll + sl]]]] % 32
+            noise += _corner4(grad4, gi, x0 - si + m * g4, y0 - sj + m * g4, z0 - sk + m * g4, w0 - sl + m * g4)
+        gi = perm[ii + 1 + perm[jj + 1 + perm[kk + 1 + perm[ll + 1]]]] % 32
+        noise += _corner4(grad4, gi, x0 - 1.0 + 4.0 * g4, y0 - 1.0 + 4.0 * g4, z0 - 1.0 + 4.0 * g4,
+                          w0 - 1.0 + 4.0 * g4)
+
+        out[n] = noise * 27.0
+
+
+@njit
+def _lerp(t, a, b):
+    return a + t * (b - a)
+
+
+@njit
+def _grad3(grad3, hash, x, y, z):
+    g = hash % 16
+    return x * grad3[g, 0] + y * grad3[g, 1] + z * grad3[g, 2]
+
+
+@njit
+def tileable3(perm, grad3, repeat, base, x, y, z, out):
+    for n in range(x.size):
+        xn = x[n]
+        yn = y[n]
+        zn = z[n]
+        fx0 = math.floor(xn)
+        fy0 = math.floor(yn)
+        fz0 = math.floor(zn)
+        i = np.int64(np.fmod(np.float64(fx0), np.float64(repeat)))
+        j = np.int64(np.fmod(np.float64(fy0), np.float64(repeat)))
+        k = np.int64(np.fmod(np.float64(fz0), np.float64(repeat)))
+        ii = (i + 1) % repeat
+        jj = (j + 1) % repeat
+        kk = (k + 1) % repeat
+        i += base
+        j += base
+        k += base
+        ii += base
+        jj += base
+        kk += base
+
+        xn -= fx0
+        yn -= fy0
+        zn -= fz0
+        fx = _pow(xn, 3.0) * (xn * (xn * 6 - 15) + 10)
+        fy = _pow(yn, 3.0) * (yn * (yn * 6 - 15) + 10)
+        fz = _pow(zn, 3.0) * (zn * (zn * 6 - 15) + 10)
+
+        A = perm[i]
+        AA = perm[A + j]
+        AB = perm[A + jj]
+        B = perm[ii]
+        BA = perm[B + j]
+        BB = perm[B + jj]
+
+        out[n] = _lerp(fz, _lerp(fy, _lerp(fx, _grad3(grad3, perm[AA + k], xn, yn, zn),
+                                           _grad3(grad3, perm[BA + k], xn - 1, yn, zn)),
+                                 _lerp(fx, _grad3(grad3, perm[AB + k], xn, yn - 1, zn),
+                                       _grad3(grad3, perm[BB + k], xn - 1, yn - 1, zn))),
+                       _lerp(fy, _lerp(fx, _grad3(grad3, perm[AA + kk], xn, yn, zn - 1),
+                                       _grad3(grad3, perm[BA + kk], xn - 1, yn, zn - 1)),
+                             _lerp(fx, _grad3(grad3, perm[AB + kk], xn, yn - 1, zn - 1),
+                                   _grad3(grad3, perm[BB + kk], xn - 1, yn - 1, zn - 1))))
@@ -0,0 +1,200 @@
+""" Connected regions of biomes across chunks
+
+Each chunk is labeled when it arrives: tiles of a REGION_BIOMES biome that
+touch, sideways or up and down, get the same label.  A RegionIndex joins
+the labels of neighbouring chunks with a union-find, so a lake that spans
+many chunks is one region.  Only the labels on the borders of a chunk are
+kept, so regions outlive the chunks they are made of.
+
+A RegionIndex has no budget of its own: it grows with every chunk added.
+InfiniteMap starts it over when it gets too big; see add_regions.
+
+Regions only include chunks that have been labeled.  A region that
+touches a chunk that was not labeled yet is not complete, and can grow.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from lib.generator import LDIRT, WATER
+
+# biomes that are split into regions
+REGION_BIOMES = (WATER, LDIRT)
+
+# labels of a chunk; biomes, sizes and boxes are indexed by label - 1
+ChunkLabels = namedtuple('ChunkLabels', 'labels biomes sizes boxes')
+
+# id is the same for tiles of the same region, but changes when regions join;
+# extent is (left, top, right, bottom) in tiles, inclusive
+Region = namedtuple('Region', 'id biome size extent complete')
+
+# borders of a chunk, and where they touch the neighbour: dx, dy, this
+# border, the neighbour's border
+TOP, BOTTOM, LEFT, RIGHT = range(4)
+SIDES = (
+    (0, -1, TOP, BOTTOM),
+    (0, 1, BOTTOM, TOP),
+    (-1, 0, LEFT, RIGHT),
+    (1, 0, RIGHT, LEFT),
+)
+
+# fields of a region in RegionIndex
+BIOME, SIZE, LEFT_X, TOP_Y, RIGHT_X, BOTTOM_Y, OPEN = range(7)
+
+
+def _find(parent, node):
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
+
+def label_chunk(biome, biomes=REGION_BIOMES):
+    """ Label the connected tiles of some biomes in a chunk
+
+    Works on runs of tiles in each row, joining runs that touch in the
+    rows above and below, so the cost depends on the number of runs.
+
+    :param biome: biome array of a chunk
+    :param biomes: biomes to label
+    :return: ChunkLabels; labels is 0 for tiles of other biomes
+    """
+    runs = list()
+    rows = list()
+    for y in range(biome.shape[0]):
+        row = biome[y]
+        starts = np.flatnonzero(np.concatenate(([True], row[1:] != row[:-1])))
+        ends = np.append(starts[1:], len(row))
+        first = len(runs)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            value = int(row[start])
+            if value in biomes:
+                runs.append((y, start, end, value))
+        rows.append((first, len(runs)))
+
+    parent = list(range(len(runs)))
+    for y in range(1, len(rows)):
+        above = range(*rows[y - 1])
+        for i in range(*rows[y]):
+            _, start, end, value = runs[i]
+            for j in above:
+                _, other_start, other_end, other_value = runs[j]
+                if other_start < end and start < other_end and other_value == value:
+                    a, b = _find(parent, i), _find(parent, j)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+    # a chunk has at most CHUNK_SIZE ** 2 / 2 labels
+    labels = np.zeros(biome.shape, dtype=np.uint16)
+    numbers = dict()
+    biomes, sizes, boxes = list(), list(), list()
+    for i, (y, start, end, value) in enumerate(runs):
+        root = _find(parent, i)
+        label = numbers.get(root)
+        if label is None:
+            label = numbers[root] = len(numbers) + 1
+            biomes.append(value)
+            sizes.append(0)
+            boxes.append([start, y, end - 1, y])
+        labels[y, start:end] = label
+        sizes[label - 1] += end - start
+        box = boxes[label - 1]
+        box[0] = min(box[0], start)
+        box[2] = max(box[2], end - 1)
+        box[3] = y
+    return ChunkLabels(labels, biomes, sizes, [tuple(box) for box in boxes])
+
+
+class RegionIndex(object):
+    """ Regions of all chunks that were added, joined across chunk borders
+
+    Each label of each chunk is a node, keyed by (cx, cy, label).  The
+    root of a region holds its biome, size, extent, and how many borders
+    of it touch chunks that were not added yet.
+    """
+
+    def __init__(self):
+        self.parent = dict()
+        self.regions = dict()
+        self.borders = dict()
+
+    def __len__(self):
+        """ Number of chunks added """
+        return len(self.borders)
+
+    def __contains__(self, key):
+        return key in self.borders
+
+    def find(self, node):
+        """ Get the root node of a region """
+        return _find(self.parent, node)
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        regions = self.regions
+        if regions[a][SIZE] < regions[b][SIZE]:
+            a, b = b, a
+        keep, join = regions[a], regions.pop(b)
+        keep[SIZE] += join[SIZE]
+        keep[LEFT_X] = min(keep[LEFT_X], join[LEFT_X])
+        keep[TOP_Y] = min(keep[TOP_Y], join[TOP_Y])
+        keep[RIGHT_X] = max(keep[RIGHT_X], join[RIGHT_X])
+        keep[BOTTOM_Y] = max(keep[BOTTOM_Y], join[BOTTOM_Y])
+        keep[OPEN] += join[OPEN]
+        self.parent[b] = a
+
+    def add_chunk(self, chunk):
+        """ Label a chunk, and join its regions with those of its neighbours
+
+        Chunks that were added before are only labeled again, if their
+        labels were dropped with the chunk.
+
+        :return: ChunkLabels of the chunk
+        """
+        labels = chunk.labels
+        if labels is None:
+            labels = chunk.labels = label_chunk(chunk.biome)
+        cx, cy = chunk.cx, chunk.cy
+        if (cx, cy) in self.borders:
+            return labels
+
+        ox, oy = chunk.origin
+        for label, (biome, size, (left, top, right, bottom)) in enumerate(
+                zip(labels.biomes, labels.sizes, labels.boxes), 1):
+            node = cx, cy, label
+            self.parent[node] = node
+            self.regions[node] = [biome, size, ox + left, oy + top, ox + right, oy + bottom, 0]
+
+        grid = labels.labels
+        borders = grid[0].copy(), grid[-1].copy(), grid[:, 0].copy(), grid[:, -1].copy()
+        self.borders[(cx, cy)] = borders
+        regions = self.regions
+        for dx, dy, side, facing in SIDES:
+            mine = borders[side]
+            neighbour = cx + dx, cy + dy
+            other = self.borders.get(neighbour)
+            if other is None:
+                for label in np.unique(mine[mine > 0]).tolist():
+                    regions[self.find((cx, cy, label))][OPEN] += 1
+                continue
+
+            theirs = other[facing]
+            # the neighbour's regions no longer touch a missing chunk here
+            for label in np.unique(theirs[theirs > 0]).tolist():
+                regions[self.find(neighbour + (label,))][OPEN] -= 1
+            touching = (mine > 0) & (theirs > 0)
+            for a, b in set(zip(mine[touching].tolist(), theirs[touching].tolist())):
+                if labels.biomes[a - 1] == regions[self.find(neighbour + (b,))][BIOME]:
+                    self.union((cx, cy, a), neighbour + (b,))
+        return labels
+
+    def region(self, cx, cy, label):
+        """ Get the region of a label of an added chunk
+
+        :return: Region
+        """
+        root = self.find((cx, cy, label))
+        biome, size, left, top, right, bottom, open_borders = self.regions[root]
+        return Region(root, biome, size, (left, top, right, bottom), open_borders == 0)
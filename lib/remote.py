@@ -0,0 +1,183 @@
+""" Maps that get their chunks from a chunk server
+
+See lib/server.py.  Requests are sent from an asyncio loop in a thread of
+its own, so the game never waits for the network unless it needs a chunk
+that is not there yet.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from lib import chunkformat, generator
+from lib.infinitemap import InfiniteMap
+from lib.server import ANSWER, OK, REQUEST, ServerError, parse_address
+from lib.workers import ChunkPool
+
+log = logging.getLogger(__name__)
+
+# seconds to wait for the loop thread when shutting down
+SHUTDOWN_TIMEOUT = 1.0
+
+# seconds to wait for a chunk before generating it here
+REQUEST_TIMEOUT = 2.0
+
+
+class RemoteChunks(ChunkPool):
+    """ ChunkPool that fetches chunks from a chunk server
+
+    All requests share one connection, which is opened when it is first
+    needed and again after it is lost.  If the server can not be reached,
+    can not make a chunk, or does not answer within REQUEST_TIMEOUT, the
+    chunk is generated here instead.
+
+    :param address: 'host:port', or the path of a unix socket
+    """
+
+    timeout = REQUEST_TIMEOUT
+
+    def __init__(self, address):
+        self.address = parse_address(address)
+        self.pending = dict()
+        self.jobs = dict()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='chunk client', daemon=True)
+        self.thread.start()
+        self._connection = None
+        self._reader = None
+        self._answers = dict()
+        self._next_id = 0
+
+    def submit(self, cx, cy, world, tilesets, rules, layers):
+        """ Request a chunk from the server
+
+        The other arguments are kept, to generate the chunk here if the
+        server fails.
+        """
+        key = cx, cy
+        if key not in self.pending:
+            self.pending[key] = asyncio.run_coroutine_threadsafe(self._fetch(cx, cy, world), self.loop)
+            self.jobs[key] = world, tilesets, rules, layers
+
+    def take(self, cx, cy):
+        """ Wait for a requested chunk
+
+        :return: Chunk, or None if the chunk was not requested
+        """
+        key = cx, cy
+        job = self.jobs.pop(key, None)
+        future = self.pending.get(key)
+        try:
+            return super(RemoteChunks, self).take(cx, cy)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            log.warning('chunk server did not answer, generating %s, %s here', cx, cy)
+            return generator.generate_chunk(cx, cy, *job)
+        except (OSError, ValueError, ServerError) as error:
+            log.warning('chunk server failed, generating %s, %s here: %s', cx, cy, error)
+            return generator.generate_chunk(cx, cy, *job)
+
+    def clear(self):
+        super(RemoteChunks, self).clear()
+        self.jobs.clear()
+
+    def shutdown(self):
+        self.clear()
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(SHUTDOWN_TIMEOUT)
+        except Exception as error:
+            log.warning('could not close the connection to the chunk server: %s', error)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(SHUTDOWN_TIMEOUT)
+
+    # everything below runs in the loop thread
+
+    async def _close(self):
+        connection = self._connection
+        if connection is not None and connection.done() and not connection.exception():
+            writer = connection.result()
+            writer.close()
+            await writer.wait_closed()
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def _connect(self):
+        if isinstance(self.address, tuple):
+            reader, writer = await asyncio.open_connection(*self.address)
+        else:
+            reader, writer = await asyncio.open_unix_connection(self.address)
+        self._reader = asyncio.ensure_future(self._read(reader))
+        return writer
+
+    async def _writer(self):
+        if self._connection is None:
+            self._connection = asyncio.ensure_future(self._connect())
+        try:
+            return await asyncio.shield(self._connection)
+        except OSError:
+            # try again with the next request
+            self._connection = None
+            raise
+
+    async def _read(self, reader):
+        """ Hand the answers to the requests that are waiting for them """
+        answers = self._answers
+        try:
+            while True:
+                request_id, status, length = ANSWER.unpack(await reader.readexactly(ANSWER.size))
+                data = await reader.readexactly(length)
+                answer = answers.pop(request_id, None)
+                if answer is None or answer.done():
+                    continue
+                if status == OK:
+                    answer.set_result(data)
+                else:
+                    answer.set_exception(ServerError(data.decode()))
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            self._connection = None
+            for answer in answers.values():
+                if not answer.done():
+                    answer.set_exception(ConnectionError('lost the connection to the chunk server'))
+            answers.clear()
+
+    async def _fetch(self, cx, cy, world):
+        writer = await self._writer()
+        request_id = self._next_id
+        self._next_id = (request_id + 1) & 0xffffffff
+        answer = self.loop.create_future()
+        self._answers[request_id] = answer
+        text = world.to_string().encode()
+        writer.write(REQUEST.pack(request_id, cx, cy, len(text)) + text)
+        try:
+            data = await answer
+        finally:
+            self._answers.pop(request_id, None)
+        # decoded by take, like the chunks from worker processes
+        header = chunkformat.read_header(data)
+        if (header.cx, header.cy) != (cx, cy):
+            raise ServerError('asked for chunk {}, {}, got {}, {}'.format(cx, cy, header.cx, header.cy))
+        return data
+
+
+class RemoteMap(InfiniteMap):
+    """ InfiniteMap that gets its chunks from a chunk server
+
+    Chunks are fetched in the background like the chunks made by workers,
+    with previews shown until they arrive; only the previews are made
+    here.  Chunks that are needed right away are fetched too, and waited
+    for.
+
+    :param address: 'host:port', or the path of a unix socket
+    """
+
+    def __init__(self, address, tile_size=(32, 32), cache_dir=None, seed=None):
+        super(RemoteMap, self).__init__(tile_size, 0, cache_dir, seed)
+        self.pool = RemoteChunks(address)
+
+    def generate_chunk(self, cx, cy):
+        key = cx, cy
+        if key not in self.pool and (self.cache is None or key not in self.cache):
+            self.pool.submit(cx, cy, self.world, self.tilesets, self.rules, self.layers)
+        return super(RemoteMap, self).generate_chunk(cx, cy)
@@ -1,133 +1,45 @@
-standard8 = {
-    257: 0,  # should be 6
-    68: 0,  # should be 9
-    0: 0,
-    1: 1,
-    3: 5,
-    4: 4,
-    6: 5,
-    7: 5,
-    9: 3,
-    11: 7,
-    15: 7,
-    36: 12,
-    38: 13,
-    39: 13,
-    64: 2,
-    72: 3,
-    73: 3,
-    75: 7,
-    201: 11,
-    294: 13,
-    256: 8,
-    288: 12,
-    292: 12,
-    384: 10,
-    416: 14,
-    420: 14,
-    448: 10,
-    456: 11,
-    480: 14,
-    47: 15,
-    5: 5,
-    200: 11,
-    192: 10,
-    457: 11,
-    484: 14,
-    79: 7,
-    295: 13,
-    488: 15,
-    320: 10,
-    207: 15,
-    71: 7,
-    260: 12,
-    422: 15,
-    65: 3,
-    203: 15,
-    328: 11,
-    489: 15,
-    324: 14,
-    495: 15,
-    491: 15,
-    431: 15,
-    100: 14,
-    76: 7,
-    356: 14,
-    492: 15,
-    128: 10,
-    452: 14,
-    486: 15,
-    388: 14,
-    193: 11,
-    459: 15,
-    262: 13,
-    423: 15,
-    77: 7,
-    111: 15,
-    331: 15,
-    303: 15,
-    421: 15,
-    385: 11,
-    259: 13,
-    67: 7,
-    461: 15,
-    463: 15,
-    487: 15,
-    267: 15,
-    289: 13,
-    263: 13,
-    333: 15,
-    13: 7,
-    327: 15,
-    367: 15,
-    493: 15,
-    453: 15,
-    265: 11,
-    417: 15,
-    455: 15,
-    199: 15,
-    103: 15,
-    460: 15,
-    325: 15,
-    359: 15,
-    108: 15,
-    365: 15,
-    449: 11,
-    393: 11,
-    291: 13,
-    329: 11,
-    425: 15,
-    485: 15,
-    196: 14,
-    70: 7,
-    293: 13,
-    205: 15,
-    358: 15,
-    357: 15,
-    299: 15,
-    321: 11,
-    69: 7,
-    66: 7,
-    32: 12,
-    8: 3,
-    109: 15,
-    364: 15,
-    454: 15,
-    230: 15,
-    462: 15,
-    335: 15,
-    204: 15,
-    102: 15,
-    261: 13,
-    481: 15,
-    395: 15,
-    419: 15,
-    271: 15,
-    132: 14,
-    12: 7,
-    198: 15,
-    352: 14,
-    236: 15,
-    366: 15,
-    2: 5,
+""" Edge tile rules
+
+An edge tile is chosen by which of its four corners show the neighbouring
+biome.  A corner shows it when any of the three tiles touching that corner
+belong to the neighbouring biome.
+
+lib.autotile.compile_rules turns these into a lookup table for every score.
+"""
+
+# tile names, in the same order as autotile.POWERS9
+neighbours = ('nw', 'w', 'sw', 'n', 'center', 's', 'ne', 'e', 'se')
+
+# tiles touching each corner
+corners = {
+    'nw': ('nw', 'n', 'w'),
+    'ne': ('ne', 'n', 'e'),
+    'sw': ('sw', 's', 'w'),
+    'se': ('se', 's', 'e'),
+}
+
+# tile type (index into a palette): corners showing the neighbouring biome
+roles = {
+    0: (),
+    1: ('nw',),
+    2: ('ne',),
+    3: ('nw', 'ne'),
+    4: ('sw',),
+    5: ('nw', 'sw'),
+    6: ('ne', 'sw'),
+    7: ('nw', 'ne', 'sw'),
+    8: ('se',),
+    9: ('nw', 'se'),
+    10: ('ne', 'se'),
+    11: ('nw', 'ne', 'se'),
+    12: ('sw', 'se'),
+    13: ('nw', 'sw', 'se'),
+    14: ('ne', 'sw', 'se'),
+    15: ('nw', 'ne', 'sw', 'se'),
+}
+
+# tile type to use when a palette has no tile for a type
+fallbacks = {
+    6: 0,  # no tiles for opposite corners
+    9: 0,
 }
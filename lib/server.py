@@ -0,0 +1,193 @@
+""" Chunk server
+
+Serves chunks to the games and tools on a host, so that the same terrain
+is generated once instead of by every process.  It listens on a unix
+socket or a TCP port:
+
+    python server.py /tmp/chunks.sock
+    python server.py localhost:7023
+
+Clients send requests, and the answers come back as the chunks are ready,
+not in order.  Requests for a chunk that is already being generated wait
+for that job, and recently served chunks are kept in memory, so chunks
+near the players are answered without generating them.
+
+Request:
+    id, cx, cy, length of the world, world as text (World.to_string)
+Answer:
+    id, status, length of the data, data
+    OK: the chunk and its world, in the format of lib/chunkformat.py
+    ERROR: the error message, utf-8
+
+Every number is little endian.
+"""
+import asyncio
+import logging
+import multiprocessing
+import struct
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import autotile, chunkformat, fields, generator
+from lib.world import World
+import lib.layers as lib_layers
+import lib.rules as lib_rules
+
+log = logging.getLogger(__name__)
+
+REQUEST = struct.Struct('<IiiH')
+ANSWER = struct.Struct('<IBI')
+
+OK = 0
+ERROR = 1
+
+# memory for the chunks kept after they are served, in bytes
+HOT_BUDGET = 64 * 1024 * 1024
+
+# compression of the chunks that are sent
+COMPRESSION = chunkformat.ZLIB
+
+
+class ServerError(Exception):
+    """ The server could not make a chunk """
+
+
+def parse_address(address):
+    """ Get a unix socket path, or a (host, port) pair
+
+    :param address: 'host:port', ':port', or the path of a unix socket
+    :return: str or (host, port)
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return host or 'localhost', int(port)
+    return address
+
+
+def _generate(cx, cy, world, tilesets, rules, layers):
+    # in the worker, so the data is encoded before it is sent back
+    chunk = generator.generate_chunk(cx, cy, world, tilesets, rules, layers)
+    return chunkformat.encode_chunk(chunk, world, COMPRESSION)
+
+
+class ChunkServer(object):
+    """ Generates and serves chunks for any seed and NOISE_SIZE
+
+    The rules and layers are compiled when the server starts; requests
+    for worlds with another rules version are answered with an error.
+
+    :param workers: worker processes; None for one per cpu, 0 to use threads
+    :param hot_budget: memory for recently served chunks, in bytes
+    """
+
+    def __init__(self, workers=None, hot_budget=HOT_BUDGET):
+        self.tilesets = dict(generator.TILESETS)
+        self.rules = autotile.compile_rules(lib_rules)
+        self.layers = fields.compile_layers(lib_layers)
+        self.rules_version = generator.rules_version(self.tilesets)
+        if workers == 0:
+            self.executor = None
+        else:
+            # workers never touch SDL; spawn so they do not inherit its state
+            context = multiprocessing.get_context('spawn')
+            self.executor = ProcessPoolExecutor(workers, mp_context=context)
+        self.hot_budget = hot_budget
+        self.hot = OrderedDict()
+        self.hot_bytes = 0
+        self.jobs = dict()
+        self.requests = 0
+        self.generated = 0
+        self.hits = 0
+
+    async def chunk(self, world, cx, cy):
+        """ Get the data of a chunk, generating it only if needed
+
+        :param world: World
+        :return: bytes from chunkformat.encode_chunk
+        """
+        self.requests += 1
+        key = world, cx, cy
+        hot = self.hot
+        try:
+            data = hot[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            hot.move_to_end(key)
+            return data
+
+        job = self.jobs.get(key)
+        if job is None:
+            if world.rules_version != self.rules_version:
+                raise ServerError('rules version {} is not {}'.format(world.rules_version, self.rules_version))
+            loop = asyncio.get_running_loop()
+            job = loop.run_in_executor(self.executor, _generate, cx, cy, world,
+                                       self.tilesets, self.rules, self.layers)
+            self.jobs[key] = job
+            job.add_done_callback(lambda job: self._finished(key, job))
+        # one client going away should not cancel the job for the others
+        return await asyncio.shield(job)
+
+    def _finished(self, key, job):
+        del self.jobs[key]
+        if job.cancelled() or job.exception() is not None:
+            return
+        self.generated += 1
+        data = job.result()
+        hot = self.hot
+        hot[key] = data
+        self.hot_bytes += len(data)
+        while self.hot_bytes > self.hot_budget and hot:
+            self.hot_bytes -= len(hot.popitem(last=False)[1])
+
+    async def answer(self, writer, request_id, cx, cy, text):
+        try:
+            data = await self.chunk(World.from_string(text), cx, cy)
+            status = OK
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            log.warning('chunk %s, %s of %s failed: %s', cx, cy, text, error)
+            data = str(error).encode()
+            status = ERROR
+        if not writer.is_closing():
+            writer.write(ANSWER.pack(request_id, status, len(data)) + data)
+
+    async def handle(self, reader, writer):
+        """ Answer the requests of one client, until it disconnects """
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST.size)
+                request_id, cx, cy, length = REQUEST.unpack(header)
+                text = (await reader.readexactly(length)).decode()
+                task = asyncio.ensure_future(self.answer(writer, request_id, cx, cy, text))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # the server is shutting down
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, address):
+        """ Serve clients until cancelled
+
+        :param address: unix socket path, or (host, port)
+        """
+        if isinstance(address, tuple):
+            server = await asyncio.start_server(self.handle, *address)
+        else:
+            server = await asyncio.start_unix_server(self.handle, address)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+""" Spatial indexes of chunks
+
+Each chunk gets a ChunkIndex the first time it is queried: the bounding box
+and cells of every biome in it, and for each biome a distance transform
+that gives the distance to, and position of, the nearest tile of that
+biome for every tile of the chunk.  The index is kept on the chunk, so it
+is built once, counts toward the memory budget of the chunk, and is
+dropped with it.
+
+InfiniteMap.biome_at, nearest and tiles_of are built on these.
+"""
+import numpy as np
+
+from lib.chunks import CHUNK_SIZE
+
+_rows = np.arange(CHUNK_SIZE)
+# squared distances between rows (or columns) of a chunk
+_SQUARES = (_rows[:, np.newaxis] - _rows[np.newaxis, :]).astype(np.float64) ** 2
+
+
+def distance_transform(mask):
+    """ Get the distance from every cell to the nearest true cell
+
+    Exact euclidean distances, found one axis at a time: first the nearest
+    true cell in each column, then the best column for each cell.
+
+    :param mask: CHUNK_SIZE x CHUNK_SIZE bool array, with a true cell
+    :return: (distance, rows, columns) arrays; rows and columns are the
+             position of the nearest true cell
+    """
+    # [y, y', x]: squared distance from row y to a true cell in row y'
+    cost = np.where(mask[np.newaxis, :, :], _SQUARES[:, :, np.newaxis], np.inf)
+    nearest_rows = cost.argmin(axis=1)
+    column_cost = np.take_along_axis(cost, nearest_rows[:, np.newaxis, :], axis=1)[:, 0, :]
+
+    # [y, x, x']: squared distance from x to the nearest true cell in column x'
+    cost = column_cost[:, np.newaxis, :] + _SQUARES[np.newaxis, :, :]
+    columns = cost.argmin(axis=2)
+    squared = np.take_along_axis(cost, columns[:, :, np.newaxis], axis=2)[:, :, 0]
+    rows = np.take_along_axis(nearest_rows, columns, axis=1)
+    return np.sqrt(squared), rows, columns
+
+
+class ChunkIndex(object):
+    """ Where each biome is in a chunk
+
+    boxes is a dict of biome: (left, top, right, bottom), and cells a dict
+    of biome: (rows, columns) arrays; both in chunk coordinates, for the
+    biomes in the chunk only.  Distance transforms are made the first time
+    they are needed, so nbytes grows as the index is queried.
+    """
+
+    def __init__(self, biome):
+        self.boxes = dict()
+        self.cells = dict()
+        self._transforms = dict()
+        self._biome = biome
+        for value in np.unique(biome):
+            rows, columns = np.nonzero(biome == value)
+            value = int(value)
+            self.cells[value] = rows, columns
+            self.boxes[value] = int(columns.min()), int(rows.min()), int(columns.max()), int(rows.max())
+
+    @property
+    def nbytes(self):
+        """ Memory of the cells and of the distance transforms made so far """
+        nbytes = sum(rows.nbytes + columns.nbytes for rows, columns in self.cells.values())
+        for transform in self._transforms.values():
+            nbytes += sum(array.nbytes for array in transform)
+        return nbytes
+
+    def transform(self, biome):
+        """ Get the distance transform of a biome that is in the chunk
+
+        :return: (distance, rows, columns) from distance_transform
+        """
+        try:
+            return self._transforms[biome]
+        except KeyError:
+            transform = distance_transform(self._biome == biome)
+            self._transforms[biome] = transform
+            return transform
+
+
+def chunk_index(chunk):
+    """ Get the index of a chunk, building it if needed """
+    if chunk.index is None:
+        chunk.index = ChunkIndex(chunk.biome)
+    return chunk.index
+
+
+def box_distance2(x, y, left, top, right, bottom):
+    """ Get the squared distance from a tile to the closest tile of a rect, inclusive """
+    dx = max(left - x, 0, x - right)
+    dy = max(top - y, 0, y - bottom)
+    return dx * dx + dy * dy
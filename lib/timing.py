@@ -0,0 +1,132 @@
+""" Per-phase frame timing
+
+A FrameTimer adds up the time spent in named phases during a frame, keeps
+the last few hundred frames for percentiles, and can stream one record per
+frame to a CSV or JSON lines file for offline analysis.
+
+    timer = FrameTimer(('input', 'draw'))
+    with timer.phase('input'):
+        handle_input()
+    timer.end_frame()
+"""
+import csv
+import json
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+HISTORY = 300
+
+
+class FrameTimer(object):
+    """ Times the phases of each frame
+
+    Phases can be nested or repeated; every phase records its own total
+    for the frame.  Phases that are not named when the timer is made are
+    added the first time they are used, but are not written to CSV files.
+
+    :param phases: names of the phases, in the order they are reported
+    :param history: frames kept for percentiles
+    """
+
+    def __init__(self, phases=(), history=HISTORY):
+        self.history = history
+        self.phases = list(phases)
+        self.frames = 0
+        self.times = {name: deque(maxlen=history) for name in self.phases}
+        self.current = dict()
+        self._started = perf_counter()
+        self._log = None
+        self._writer = None
+
+    @contextmanager
+    def phase(self, name):
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - begin)
+
+    def add(self, name, seconds):
+        """ Add time to a phase of the current frame """
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def end_frame(self):
+        """ Store the current frame and start a new one """
+        current = self.current
+        for name in current:
+            if name not in self.times:
+                self.phases.append(name)
+                self.times[name] = deque(maxlen=self.history)
+        for name in self.phases:
+            self.times[name].append(current.get(name, 0.0))
+
+        if self._writer is not None:
+            self._writer(self.record())
+
+        self.frames += 1
+        self.current = dict()
+
+    def record(self):
+        """ Get the current frame as a dict, times in milliseconds """
+        record = {'frame': self.frames, 'time': round(perf_counter() - self._started, 6)}
+        for name in self.phases:
+            record[name] = round(self.current.get(name, 0.0) * 1000, 4)
+        return record
+
+    def percentiles(self, *percents):
+        """ Get percentiles of every phase over the recent frames
+
+        :param percents: percentiles to get, 0 to 100
+        :return: list of (phase, [milliseconds, ...])
+        """
+        summary = list()
+        for name in self.phases:
+            times = self.times[name]
+            if times:
+                values = np.percentile(np.array(times), percents) * 1000
+            else:
+                values = [0.0] * len(percents)
+            summary.append((name, [float(v) for v in values]))
+        return summary
+
+    def open_log(self, filename):
+        """ Write a record of every frame to a file
+
+        The format is chosen by the extension: .csv, or else JSON lines.
+        """
+        self.close_log()
+        self._log = open(filename, 'w', newline='')
+        if filename.lower().endswith('.csv'):
+            writer = csv.DictWriter(self._log, ['frame', 'time'] + self.phases, extrasaction='ignore')
+            writer.writeheader()
+            self._writer = writer.writerow
+        else:
+            log = self._log
+
+            def write(record):
+                log.write(json.dumps(record) + '\n')
+
+            self._writer = write
+
+    def close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+            self._writer = None
+
+
+class NullTimer(object):
+    """ Timer that does nothing, used when timing is off """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def add(self, name, seconds):
+        pass
+
+
+NULL_TIMER = NullTimer()
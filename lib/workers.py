@@ -0,0 +1,89 @@
+""" Parallel chunk generation
+
+Chunk jobs are sent to a pool of worker processes.  Finished chunks are
+handed back on the caller's thread by ChunkPool.collect, so the map is only
+ever changed from the thread that draws it.
+
+Workers send chunks back in the RAW format of lib.chunkformat, which is
+one small buffer to pickle, and is decoded without copying.
+"""
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from lib import chunkformat
+from lib.generator import generate_chunk
+
+
+def _generate(cx, cy, world, tilesets, rules, layers):
+    return chunkformat.encode_chunk(generate_chunk(cx, cy, world, tilesets, rules, layers))
+
+
+class ChunkPool(object):
+    """ Generates chunks in worker processes
+
+    Only one job is queued for each chunk at a time.  take waits up to
+    timeout seconds for a chunk, or for ever if it is None.
+    """
+
+    timeout = None
+
+    def __init__(self, workers=None):
+        # workers never touch SDL; spawn so they do not inherit its state
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(workers, mp_context=context)
+        self.pending = dict()
+
+    def __contains__(self, key):
+        return key in self.pending
+
+    def submit(self, cx, cy, world, tilesets, rules, layers):
+        """ Queue a chunk to be generated
+
+        :param cx: chunk x
+        :param cy: chunk y
+        :param world: world.World
+        :param tilesets: dict of tile palettes
+        :param rules: autotile.RuleTable
+        :param layers: fields.LayerGraph
+        """
+        key = cx, cy
+        if key not in self.pending:
+            self.pending[key] = self.executor.submit(
+                _generate, cx, cy, world, tilesets, rules, layers)
+
+    def take(self, cx, cy):
+        """ Wait for a queued chunk
+
+        :return: Chunk, or None if the chunk was not queued
+        """
+        future = self.pending.pop((cx, cy), None)
+        if future is None:
+            return None
+        try:
+            data = future.result(self.timeout)
+        except CancelledError:
+            return None
+        return chunkformat.decode_chunk(data)[0]
+
+    def collect(self):
+        """ Get all chunks that are finished, without waiting
+
+        :return: list of Chunks
+        """
+        done = [key for key, future in self.pending.items() if future.done()]
+        chunks = list()
+        for key in done:
+            chunk = self.take(*key)
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def clear(self):
+        """ Forget all queued jobs; results of running jobs are discarded """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,57 @@
+""" World descriptors
+
+A World names everything that decides the terrain: the noise seed and
+period, NOISE_SIZE and the rules version.  It is a few numbers, so it can be
+sent to worker processes or other hosts, used as a cache key, or written
+down, and any process can make the same terrain from it.
+
+    world = World(1234, 256, 32, generator.rules_version(tilesets))
+    text = world.to_string()        # 'v1:1234:256:32.0:00d80465c254'
+    World.from_string(text) == world
+"""
+from collections import namedtuple
+
+from lib import perlin
+
+# first field of the text form; it changes with the permutation generator
+PREFIX = 'v{}'.format(perlin.PRNG_VERSION)
+
+
+class World(namedtuple('World', 'seed period noise_size rules_version')):
+    """ Everything that decides the terrain
+
+    seed is None for the default permutation table of lib.perlin, which
+    has a period of 256.
+    """
+    __slots__ = ()
+
+    def noise(self):
+        """ Make the noise generator of this world
+
+        :return: perlin.SimplexNoise
+        """
+        if self.seed is None:
+            noise = perlin.SimplexNoise()
+            if self.period != noise.period:
+                raise ValueError('the default permutation table has a period of {}'.format(noise.period))
+            return noise
+        return perlin.SimplexNoise(period=self.period, seed=self.seed)
+
+    def to_string(self):
+        """ Get the world as text, that from_string reads """
+        seed = '-' if self.seed is None else self.seed
+        return '{}:{}:{}:{!r}:{}'.format(PREFIX, seed, self.period, float(self.noise_size), self.rules_version)
+
+    @classmethod
+    def from_string(cls, text):
+        """ Read a world written by to_string
+
+        Raises ValueError if the text is not a world, or was written with
+        another permutation generator.
+        """
+        fields = text.split(':')
+        if len(fields) != 5 or fields[0] != PREFIX:
+            raise ValueError('{!r} is not a {} world'.format(text, PREFIX))
+        prefix, seed, period, noise_size, rules_version = fields
+        seed = None if seed == '-' else int(seed)
+        return cls(seed, int(period), float(noise_size), rules_version)
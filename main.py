@@ -4,8 +4,7 @@ requires pygame and pytmx.
 https://github.com/bitcraft/pytmx
 pip install pytmx
 """
-import math
-from time import time
+import argparse
 
 import pygame
 from pygame.locals import *
@@ -14,12 +13,28 @@ import pyscroll
 import pyscroll.data
 from pyscroll.group import PyscrollGroup
 
-from lib.perlin import SimplexNoise
+from lib.config import CACHE_DIR
+from lib.entities import Entities, tinted_images
 from lib.infinitemap import InfiniteMap
+from lib.remote import RemoteMap
 from lib.resources import load_image
+from lib.timing import FrameTimer
 
 HERO_MOVE_SPEED = 300  # pixels per second
 
+# wandering entities, and how far from the hero they start, in pixels
+ENTITY_COUNT = 2000
+SPAWN_RADIUS = 48 * 32
+
+# phases of a frame that are timed; entities happens inside of update, and
+# prepare_tiles, cache, wait, generate, regions, preview and redraw inside
+# of draw
+TIMED_PHASES = ('input', 'redraw', 'update', 'entities', 'draw', 'prepare_tiles', 'cache', 'wait',
+                'generate', 'regions', 'preview', 'overlay', 'flip')
+
+# frames between updates of the timing overlay
+OVERLAY_INTERVAL = 30
+
 
 def init_screen(width, height):
     # simple wrapper to keep the screen resizeable
@@ -39,16 +54,20 @@ class Hero(pygame.sprite.Sprite):
     collisions, while the 'rect' rect is used for drawing.
     There is also an old_rect that is used to reposition the sprite if it
     collides with level walls.
+    With a terrain, the feet are swept through it each update, so the Hero
+    stops at WATER and WALL tiles instead of walking over them.
     """
 
-    def __init__(self):
+    def __init__(self, terrain=None):
         pygame.sprite.Sprite.__init__(self)
         self.image = load_image('hero.png').convert_alpha()
+        self.terrain = terrain
         self.velocity = [0, 0]
         self._position = [0, 0]
         self._old_position = self.position
         self.rect = self.image.get_rect()
         self.feet = pygame.Rect(0, 0, self.rect.width * .5, 8)
+        self.feet.midbottom = self.rect.midbottom
 
     @property
     def position(self):
@@ -57,11 +76,17 @@ class Hero(pygame.sprite.Sprite):
     @position.setter
     def position(self, value):
         self._position = list(value)
+        self.rect.topleft = self._position
+        self.feet.midbottom = self.rect.midbottom
 
     def update(self, dt):
         self._old_position = self._position[:]
-        self._position[0] += self.velocity[0] * dt
-        self._position[1] += self.velocity[1] * dt
+        dx = self.velocity[0] * dt
+        dy = self.velocity[1] * dt
+        if self.terrain is not None:
+            dx, dy = self.terrain.sweep_rect(self.feet, dx, dy)
+        self._position[0] += dx
+        self._position[1] += dy
         self.rect.topleft = self._position
         self.feet.midbottom = self.rect.midbottom
 
@@ -78,30 +103,60 @@ class QuestGame(object):
     This class will load resources, create a pyscroll group, a hero object.
     It also reads input and moves the Hero around the map.
     Finally, it uses a pyscroll group to render the map and Hero.
+
+    The world is populated with entities that wander around on their own;
+    only the ones on screen are given to the group as sprites.
+
+    Each frame is timed by phase.  The timings can be shown on screen (press
+    t to toggle), and every frame can be written to a CSV or JSON lines
+    file with the timings argument.
     """
 
-    def __init__(self):
+    def __init__(self, timings=None, show_timings=False, seed=None, server=None, entities=ENTITY_COUNT):
 
         # true while running
         self.running = False
 
-        # create new data source for pyscroll
-        self.map_data = InfiniteMap()
-
-        # create new renderer (camera)
-        self.map_layer = pyscroll.BufferedRenderer(self.map_data, screen.get_size())
-        self.map_layer.zoom = 1
+        self.timer = FrameTimer(TIMED_PHASES)
+        if timings:
+            self.timer.open_log(timings)
+        self.show_timings = show_timings
+        self.timings_image = None
+        self.font = pygame.font.Font(None, 20)
 
-        # pyscroll supports layered rendering.  our map has 3 'under' layers
-        # layers begin with 0, so the layers are 0, 1, and 2.
-        # since we want the sprite to be on top of layer 1, we set the default
-        # layer for sprites as 2
-        self.group = PyscrollGroup(map_layer=self.map_layer, default_layer=2)
-        self.hero = Hero()
-        self.hero.position = 518 * 32, 560 * 32
+        # create new data source for pyscroll
+        # terrain is generated by worker processes, one per cpu, and saved
+        # in the cache folder so it is only generated once, or fetched from
+        # a chunk server
+        if server:
+            self.map_data = RemoteMap(server, cache_dir=CACHE_DIR, seed=seed)
+        else:
+            self.map_data = InfiniteMap(workers=None, cache_dir=CACHE_DIR, seed=seed)
+        self.map_data.timer = self.timer
 
-        # add our hero to the group
-        self.group.add(self.hero)
+        # the map has to be closed if the rest fails
+        try:
+            # create new renderer (camera)
+            self.map_layer = pyscroll.BufferedRenderer(self.map_data, screen.get_size())
+            self.map_layer.zoom = 1
+
+            # pyscroll supports layered rendering.  our map has 3 'under' layers
+            # layers begin with 0, so the layers are 0, 1, and 2.
+            # since we want the sprite to be on top of layer 1, we set the default
+            # layer for sprites as 2
+            self.group = PyscrollGroup(map_layer=self.map_layer, default_layer=2)
+            self.hero = Hero(self.map_data)
+            self.hero.position = 518 * 32, 560 * 32
+
+            # add our hero to the group
+            self.group.add(self.hero)
+
+            # entities are drawn by the group too, but are not sprites
+            self.entities = Entities(self.map_data, tinted_images(self.hero.image))
+            self.entities.spawn_around(self.hero.feet.midbottom, SPAWN_RADIUS, entities)
+        except:
+            self.map_data.close()
+            raise
 
     def draw(self, surface):
 
@@ -109,8 +164,26 @@ class QuestGame(object):
         self.group.center(self.hero.rect.center)
 
         # draw the map and all sprites
+        self.entities.show(self.group, self.group.view)
         self.group.draw(surface)
 
+    def draw_timings(self, surface):
+        """ Draw the 50th and 99th percentile time of each phase
+        """
+        if self.timings_image is None or self.timer.frames % OVERLAY_INTERVAL == 0:
+            lines = ['{:<14}{:>8}{:>8}'.format('ms', 'p50', 'p99')]
+            for name, (p50, p99) in self.timer.percentiles(50, 99):
+                lines.append('{:<14}{:>8.2f}{:>8.2f}'.format(name, p50, p99))
+
+            line_height = self.font.get_linesize()
+            width = max(self.font.size(line)[0] for line in lines)
+            image = pygame.Surface((width + 8, line_height * len(lines) + 8))
+            for i, line in enumerate(lines):
+                image.blit(self.font.render(line, 1, (255, 255, 255)), (4, 4 + i * line_height))
+            self.timings_image = image
+
+        surface.blit(self.timings_image, (0, 0))
+
     def handle_input(self):
         """ Handle pygame input events
         """
@@ -129,19 +202,22 @@ class QuestGame(object):
 
                 elif event.key == K_r:
                     self.map_data.reload()
-                    self.map_layer.redraw_tiles(self.map_layer._buffer)
 
                 elif event.key == K_q:
-                    self.map_data.NOISE_SIZE -= .5
+                    self.map_data.set_noise_size(self.map_data.NOISE_SIZE - .5)
                     self.hero.position = self.hero.position[0] * .985, self.hero.position[1] * .985
-                    self.map_data.reload()
-                    self.map_layer.redraw_tiles(self.map_layer._buffer)
+                    self.entities.scale(.985)
 
                 elif event.key == K_w:
-                    self.map_data.NOISE_SIZE += .5
-                    self.map_data.reload()
+                    self.map_data.set_noise_size(self.map_data.NOISE_SIZE + .5)
                     self.hero.position = self.hero.position[0] * 1.015, self.hero.position[1] * 1.015
-                    self.map_layer.redraw_tiles(self.map_layer._buffer)
+                    self.entities.scale(1.015)
+
+                elif event.key == K_t:
+                    self.show_timings = not self.show_timings
+
+                elif event.key == K_c:
+                    self.map_data.debug_codes = not self.map_data.debug_codes
 
                 elif event.key == K_EQUALS:
                     self.map_layer.zoom += .25
@@ -179,69 +255,64 @@ class QuestGame(object):
         """ Tasks that occur over time should be handled here
         """
         self.group.update(dt)
+        with self.timer.phase('entities'):
+            self.entities.update(dt)
 
     def run(self):
         """ Run the game loop
         """
         clock = pygame.time.Clock()
         self.running = True
-
-        from collections import deque
-        times = deque(maxlen=300)
-
-        noise = SimplexNoise().noise2
-        two_pi = 2 * math.pi
-
-        poll = 1
+        timer = self.timer
 
         try:
             while self.running:
                 dt = clock.tick_busy_loop(60) / 1000.
 
-                self.handle_input()
-                self.update(dt)
-
-                begin = time()
-                self.draw(screen)
-                times.append(time() - begin)
-
-                # if len(times) > 0:
-                #     print(len(times), round(sum(times) / len(times), 4))
-
-                #
-                # poll -= dt
-                # if poll < 0:
-                #     self.map_data._first_draw = True
-                #     self.map_data.reload()
-                #     self.map_layer.redraw_tiles(self.map_layer._buffer)
-
-                # xx, yy = self.hero.position
-                #
-                # xx /= 1000
-                # yy /= 1000
-                #
-                # for y in range(0, 320, 32):
-                #     for x in range(0, 320, 32):
-                #         v = (noise(xx + x / 1000, yy + y / 1000) + 1) * 128
-                #         color = v, v, v
-                #         print(color)
-                #         screen.fill(color, (x, y, 32, 32))
-
-                pygame.display.flip()
+                with timer.phase('input'):
+                    self.handle_input()
+                with timer.phase('update'):
+                    self.update(dt)
+                with timer.phase('draw'):
+                    self.draw(screen)
+
+                if self.show_timings:
+                    with timer.phase('overlay'):
+                        self.draw_timings(screen)
+
+                with timer.phase('flip'):
+                    pygame.display.flip()
+
+                timer.end_frame()
 
         except KeyboardInterrupt:
             self.running = False
 
+        finally:
+            timer.close_log()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quest - An epic journey.')
+    parser.add_argument('--timings', help='write the timings of every frame to this .csv or .jsonl file')
+    parser.add_argument('--show-timings', action='store_true', help='show frame timings on screen')
+    parser.add_argument('--seed', type=int, help='world seed (default: the default world)')
+    parser.add_argument('--server', help='get chunks from the chunk server at this socket path or host:port')
+    parser.add_argument('--entities', type=int, default=ENTITY_COUNT, help='wandering entities to add')
+    args = parser.parse_args()
+
     pygame.init()
     pygame.font.init()
     screen = init_screen(1024, 1024)
     pygame.display.set_caption('Quest - An epic journey.')
 
+    game = None
     try:
-        game = QuestGame()
+        game = QuestGame(args.timings, args.show_timings, args.seed, args.server, args.entities)
         game.run()
     except:
         pygame.quit()
         raise
+    finally:
+        if game is not None:
+            game.map_data.close()
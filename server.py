@@ -0,0 +1,47 @@
+""" Serve chunks to games and tools on this host
+
+    python server.py /tmp/chunks.sock
+    python server.py localhost:7023
+
+Then start the game with the same address:
+
+    python main.py --server /tmp/chunks.sock
+
+Any seed and NOISE_SIZE can be requested, as long as the client has the
+same rules as the server.
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+from lib.server import HOT_BUDGET, ChunkServer, parse_address
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('address', help='unix socket path, or host:port')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes; 0 to generate in threads (default: one per cpu)')
+    parser.add_argument('--hot', type=int, default=HOT_BUDGET // 2 ** 20,
+                        help='megabytes of recently served chunks kept in memory')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    address = parse_address(args.address)
+    server = ChunkServer(args.workers, args.hot * 2 ** 20)
+    print('serving chunks on', args.address)
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.remove(address)
+        print('{} requests, {} chunks generated, {} served from memory'.format(
+            server.requests, server.generated, server.hits))
+
+
+if __name__ == '__main__':
+    main()